@@ -0,0 +1,47 @@
+"""
+Per request JWT verification cost
+
+Compares atlassian_jwt's reference Authenticator (pyjwt decode twice,
+fresh query string hash) with the add-on's own authenticator.
+
+Usage::
+
+    python benchmarks/bench_auth.py [iterations]
+"""
+import sys
+import timeit
+
+from atlassian_jwt import Authenticator, encode_token
+from chalice import Chalice
+
+from chalice_atlassian_connect import AtlassianConnect, ClientRecord
+
+CONFIG = {
+    'ADDON_KEY': 'bench-addon',
+    'ADDON_VENDOR_NAME': 'SinglePlatform',
+    'ADDON_VENDOR_URL': 'https://www.singleplatform.com',
+}
+SECRET = 'a-shared-secret-that-is-long-enough-for-hs256'
+URL = '/webPanels/userPanel?issueKey=TEST-1&projectKey=TEST'
+
+
+class _ReferenceAuthenticator(Authenticator):
+    def get_shared_secret(self, client_key):
+        return SECRET
+
+
+def main(iterations=20000):
+    ac = AtlassianConnect(Chalice('bench'), config=CONFIG)
+    ac.client_class.save(ClientRecord(clientKey='bench', sharedSecret=SECRET))
+    headers = {'Authorization': 'JWT ' + encode_token('GET', URL, 'bench', SECRET)}
+    reference = _ReferenceAuthenticator()
+
+    for name, authenticator in (('atlassian_jwt', reference), ('fast path', ac.auth)):
+        seconds = min(timeit.repeat(
+            lambda: authenticator.authenticate('GET', URL, headers),
+            number=iterations, repeat=3))
+        print('%-14s %8.2f us/request' % (name, seconds / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,222 @@
+"""
+Overhead of the add-on on its request hot paths
+
+Requests go through Chalice's test client to an add-on using the in memory
+client store, with a local stub serving consumer-info to installs. Each
+scenario reports ops/sec and p50/p99 latencies as JSON.
+
+A saved run can be used as a baseline, scenarios whose p50 latency grew by
+more than the threshold are flagged and the exit status is 1.
+
+Usage::
+
+    python benchmarks/bench_hotpaths.py [-n iterations] [--save run.json]
+        [--baseline run.json] [--threshold 0.2] [scenario ...]
+"""
+import argparse
+import itertools
+import json
+import platform
+import sys
+import threading
+import time
+
+from atlassian_jwt import encode_token
+from chalice import Chalice
+from chalice.test import Client
+
+from chalice_atlassian_connect import AtlassianConnect, ClientRecord
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+CONFIG = {
+    'ADDON_KEY': 'bench-addon',
+    'ADDON_VENDOR_NAME': 'SinglePlatform',
+    'ADDON_VENDOR_URL': 'https://www.singleplatform.com',
+}
+SECRET = 'a-shared-secret-that-is-long-enough-for-hs256'
+JSON = {'Content-Type': 'application/json'}
+
+CONSUMER_INFO = """<?xml version="1.0" encoding="UTF-8"?>
+<consumer>
+<key>%s</key>
+<name>JIRA</name>
+<publicKey>public-%s</publicKey>
+</consumer>"""
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubConsumerInfo(BaseHTTPRequestHandler):
+    """consumer-info of the instance whose baseUrl is /<clientKey>"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't wait on delayed acks
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        key = self.path.split('/')[1]
+        body = (CONSUMER_INFO % (key, key)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _auth(method, path, client_key='bench'):
+    return {'Authorization': 'JWT ' + encode_token(method, path, client_key, SECRET)}
+
+
+def _addon():
+    app = Chalice('bench')
+    ac = AtlassianConnect(app, config=CONFIG)
+    ac.client_class.save(ClientRecord(clientKey='bench', sharedSecret=SECRET))
+
+    @ac.module(key='configurePage', name='Configure')
+    def configure_page(client):
+        return {'clientKey': client.clientKey}
+
+    @ac.webpanel(key='userPanel', name='User panel', location='atl.jira.view.issue.right.context')
+    def user_panel(client, issueKey=None):
+        return {'issueKey': issueKey}
+
+    @ac.webhook('jira:issue_created')
+    def issue_created(client, event):
+        pass
+
+    @ac.lifecycle('installed')
+    def installed(client):
+        pass
+
+    @app.route('/issues/{key}')
+    def issue(key):
+        return {}
+
+    return app, ac
+
+
+def _scenarios(app, ac, base_url):
+    """Name and callable making one request, for each scenario"""
+    http = Client(app).http
+    module_headers = _auth('GET', '/modules/configurePage')
+    panel_headers = _auth('GET', '/webPanels/userPanel')
+    webhook_headers = dict(JSON, **_auth('POST', '/webhooks/jiraissue_created'))
+    event = json.dumps({'issue': {'key': 'TEST-1', 'fields': {'summary': 'x' * 200}}})
+    keys = itertools.count()
+
+    def install():
+        key = 'tenant%d' % next(keys)
+        body = json.dumps({'clientKey': key, 'publicKey': 'public-' + key,
+                           'sharedSecret': SECRET, 'baseUrl': base_url + '/' + key})
+        return http.post('/lifecycle/installed', body=body, headers=JSON)
+
+    reinstall_body = json.dumps({
+        'clientKey': 'bench', 'publicKey': 'public-bench',
+        'sharedSecret': SECRET, 'baseUrl': base_url + '/bench'})
+    reinstall_headers = dict(JSON, **_auth('POST', '/lifecycle/installed'))
+
+    return [
+        ('descriptor', lambda: http.get(
+            '/atlassian-connect.json', headers={'Host': 'bench.example.com'})),
+        ('module', lambda: http.get('/modules/configurePage', headers=module_headers)),
+        ('webpanel', lambda: http.get(
+            '/webPanels/userPanel?issueKey=TEST-1', headers=panel_headers)),
+        ('webhook', lambda: http.post(
+            '/webhooks/jiraissue_created', body=event, headers=webhook_headers)),
+        ('install', install),
+        ('reinstall', lambda: http.post(
+            '/lifecycle/installed', body=reinstall_body, headers=reinstall_headers)),
+        ('url_for', lambda: ac.url_for('issue', key='TEST-1', expand='names')),
+    ]
+
+
+def _measure(func, iterations, warmup):
+    for _ in range(warmup):
+        func()
+    timings = []
+    timer = time.perf_counter if hasattr(time, 'perf_counter') else time.time
+    for _ in range(iterations):
+        start = timer()
+        result = func()
+        timings.append(timer() - start)
+        status = getattr(result, 'status_code', 200)
+        if status >= 400:
+            raise RuntimeError('benchmark request failed with %d' % status)
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'ops_per_sec': round(iterations / sum(timings), 1),
+        'p50_us': round(timings[len(timings) // 2] * 1e6, 1),
+        'p99_us': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6, 1),
+    }
+
+
+def run(iterations=2000, warmup=200, only=None):
+    """
+    Run the scenarios, all of them unless only names some
+
+    :rtype: dict"""
+    server = _ThreadingServer(('127.0.0.1', 0), _StubConsumerInfo)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    app, ac = _addon()
+    try:
+        results = {}
+        base_url = 'http://127.0.0.1:%d' % server.server_port
+        for name, func in _scenarios(app, ac, base_url):
+            if not only or name in only:
+                results[name] = _measure(func, iterations, warmup)
+    finally:
+        ac.http.close()
+        server.shutdown()
+        server.server_close()
+    return {'python': platform.python_version(), 'results': results}
+
+
+def regressions(results, baseline, threshold):
+    """Scenarios whose p50 grew by more than threshold, with the ratio"""
+    slower = {}
+    for name, result in results['results'].items():
+        before = baseline['results'].get(name)
+        if before and before['p50_us']:
+            ratio = result['p50_us'] / before['p50_us']
+            if ratio > 1 + threshold:
+                slower[name] = round(ratio, 2)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run, all by default')
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='p50 growth flagged as a regression (default 0.2)')
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.warmup, args.scenarios)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            results['regressions'] = regressions(results, json.load(baseline), args.threshold)
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.save:
+        with open(args.save, 'w') as saved:
+            saved.write(output + '\n')
+    print(output)
+    return 1 if results.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Import time of the package, as reported by ``python -X importtime``
+
+Each run imports the package in a fresh interpreter and the fastest run is
+reported: the package's cumulative import time and the slowest modules
+imported by the package's own modules.
+
+Usage::
+
+    python benchmarks/bench_import.py [runs] [top]
+"""
+import subprocess
+import sys
+
+PACKAGE = 'chalice_atlassian_connect'
+
+
+def _importtime():
+    """
+    Cumulative import time in microseconds of the package, and of each
+    dependency imported by one of the package's modules"""
+    stderr = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + PACKAGE],
+        stderr=subprocess.PIPE).communicate()[1].decode('utf-8')
+    total = None
+    dependencies = []
+    parents = []
+    # Reversed, every module is listed before the modules it imported
+    for line in reversed(stderr.splitlines()):
+        fields = line.split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        name, usec = name.strip(), int(fields[1])
+        del parents[depth:]
+        parents.append(name)
+        if depth == 0:
+            if total is not None:
+                break
+            if name == PACKAGE:
+                total = usec
+        elif total is not None and parents[-2].startswith(PACKAGE) \
+                and not name.startswith(PACKAGE):
+            dependencies.append((name, usec))
+    return total, dependencies
+
+
+def main(runs=5, top=10):
+    if sys.version_info < (3, 7):
+        sys.exit('-X importtime needs python 3.7 or later')
+    total, dependencies = min(_importtime() for _ in range(runs))
+    print('%-45s %10s' % ('module', 'usec'))
+    for name, usec in sorted(dependencies, key=lambda dep: -dep[1])[:top]:
+        print('%-45s %10d' % (name, usec))
+    print('%-45s %10d' % (PACKAGE + ' (cumulative)', total))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
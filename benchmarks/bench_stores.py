@@ -0,0 +1,110 @@
+"""
+Throughput of the client stores
+
+Saves clients one by one, loads them one by one, loads them in batches of
+100 and lists them, with the in memory and SQLite stores and, given an
+endpoint such as DynamoDB Local, the DynamoDB store. Results are printed
+as JSON in operations per second.
+
+Usage::
+
+    python benchmarks/bench_stores.py [-n clients]
+        [--dynamodb-endpoint http://localhost:8000]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from chalice_atlassian_connect import AtlassianConnectClient
+from chalice_atlassian_connect.client import (
+    DynamoDBAtlassianConnectClient,
+    SQLiteAtlassianConnectClient,
+)
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    # python2
+    _clock = time.time
+
+
+def _dynamodb(endpoint_url, table_name='bench-clients'):
+    """DynamoDB store on a fresh table at endpoint_url"""
+    store = DynamoDBAtlassianConnectClient(
+        table_name=table_name, endpoint_url=endpoint_url, region_name='us-east-1')
+    client = store.table.meta.client
+    try:
+        client.delete_table(TableName=table_name)
+        client.get_waiter('table_not_exists').wait(TableName=table_name)
+    except client.exceptions.ResourceNotFoundException:
+        pass
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'clientKey', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'clientKey', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST')
+    client.get_waiter('table_exists').wait(TableName=table_name)
+    return store
+
+
+def _rate(count, func):
+    start = _clock()
+    func()
+    return round(count / (_clock() - start), 1)
+
+
+def bench(store, count):
+    """Operations per second of each operation on store"""
+    keys = ['client%06d' % i for i in range(count)]
+    clients = [{'clientKey': key, 'sharedSecret': 'secret-' + key,
+                'baseUrl': 'https://%s.atlassian.net' % key} for key in keys]
+
+    def save():
+        for client in clients:
+            store.save(client)
+
+    def load():
+        for key in keys:
+            store.load(key)
+
+    def load_many():
+        for start in range(0, count, 100):
+            store.load_many(keys[start:start + 100])
+
+    results = {
+        'save': _rate(count, save),
+        'load': _rate(count, load),
+        'load_many': _rate(count, load_many),
+        'all': _rate(count, lambda: list(store.all())),
+    }
+    if hasattr(store, 'save_many'):
+        results['save_many'] = _rate(count, lambda: store.save_many(clients))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('-n', '--clients', type=int, default=2000)
+    parser.add_argument('--dynamodb-endpoint', help='DynamoDB to benchmark against')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    try:
+        results = {
+            'memory': bench(AtlassianConnectClient(), args.clients),
+            'sqlite': bench(
+                SQLiteAtlassianConnectClient(os.path.join(directory, 'clients.db')),
+                args.clients),
+        }
+    finally:
+        shutil.rmtree(directory)
+    if args.dynamodb_endpoint:
+        results['dynamodb'] = bench(_dynamodb(args.dynamodb_endpoint), args.clients)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,289 @@
+import base64
+import hmac
+import json
 import re
+import threading
+import time
+from collections import namedtuple
 from functools import wraps
+from hashlib import sha1, sha256, sha384, sha512
 
-from atlassian_jwt import Authenticator, encode_token
 from chalice import (
     ChaliceViewError,
+    ConflictError,
     NotFoundError,
     Response,
     UnauthorizedError,
 )
-from jwt import decode
-from jwt.exceptions import DecodeError
-from requests import get
-from .client import AtlassianConnectClient
+from chalice.app import handle_extra_types
+from .cache import _MISSING, CachedClient, ClientCache, ConsumerInfoCache, ResponseCache
+from .client import AtlassianConnectClient, ClientRecord, VersionConflict
+from .rest import AtlassianRestClient
+from .session import HttpClient
 
 try:
     # python2
-    from urllib import urlencode
+    from urllib import quote, urlencode
 except ImportError:
     # python3
-    from urllib.parse import urlencode
+    from urllib.parse import quote, urlencode
+
+try:
+    # python2
+    string_types = basestring
+except NameError:
+    # python3
+    string_types = str
+
+
+_PATH_PARAM = re.compile(r'{([^}]+)}')
+
+# Number of distinct scheme/host descriptor renderings kept around
+_DESCRIPTOR_CACHE_SIZE = 32
+
+# Methods Atlassian calls each kind of handler with, when routed directly
+_SECTION_METHODS = {
+    'lifecycle': ['POST'],
+    'webhooks': ['POST'],
+    'blueprints': ['GET'],
+    'blueprint_contexts': ['POST'],
+    # Forms signed with atlassian_jwt_post_url post back to the module
+    'modules': ['GET', 'POST'],
+    'webPanels': ['GET', 'POST'],
+}
+
+_HMAC_DIGESTS = {'HS256': sha256, 'HS384': sha384, 'HS512': sha512}
+
+AuthResult = namedtuple('AuthResult', ['client_key', 'claims'])
+
+ClientAuthResult = namedtuple(
+    'ClientAuthResult', ['client_key', 'claims', 'client', 'lookups'])
+
+
+class _DuplicateDelivery(Exception):
+    """Raised by a webhook handler for a delivery that was already handled"""
+
+
+def _jwt_errors():
+    """
+    pyjwt's exceptions module. jwt and atlassian_jwt are imported on first
+    use rather than with the package, to keep cold starts short"""
+    from jwt import exceptions
+    return exceptions
 
 
-class _SimpleAuthenticator(Authenticator):
-    """Implementation of Authenticator for Atlassian"""
-    def __init__(self, addon, *args, **kwargs):
-        super(_SimpleAuthenticator, self).__init__(*args, **kwargs)
+def _b64decode(segment):
+    if not isinstance(segment, bytes):
+        segment = segment.encode('ascii')
+    return base64.urlsafe_b64decode(segment + b'=' * (-len(segment) % 4))
+
+
+def _parse_token(token):
+    """
+    Split a JWT into its header, claims, signing input and signature
+    without verifying anything
+
+    :raises DecodeError: if the token is malformed"""
+    try:
+        if not isinstance(token, bytes):
+            token = token.encode('ascii')
+        signing_input, signature = token.rsplit(b'.', 1)
+        header_segment, claims_segment = signing_input.split(b'.', 1)
+        header = json.loads(_b64decode(header_segment).decode('utf-8'))
+        claims = json.loads(_b64decode(claims_segment).decode('utf-8'))
+        signature = _b64decode(signature)
+    except (ValueError, TypeError, UnicodeError):
+        raise _jwt_errors().DecodeError('Invalid token')
+    if not isinstance(header, dict) or not isinstance(claims, dict):
+        raise _jwt_errors().DecodeError('Invalid token')
+    return header, claims, signing_input, signature
+
+
+def _etag_matches(etag, if_none_match):
+    """Check an ETag against the value of an If-None-Match header"""
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in ('*', etag):
+            return True
+    return False
+
+
+class _SimpleAuthenticator(object):
+    """Implementation of Authenticator for Atlassian
+
+    Verification is done here rather than by pyjwt: malformed tokens and
+    query string hash mismatches are rejected before the store is asked
+    for a shared secret, HMAC keys are prepared once per client and query
+    string hashes are remembered for repeated method/url pairs."""
+    def __init__(self, addon, algorithms=('HS256',), leeway=90):
         self.addon = addon
+        self.algorithms = algorithms
+        self.leeway = leeway
+        self._local = threading.local()
+        self._hmac_keys = ClientCache(maxsize=1024, ttl=3600)
+        self._url_hashes = ClientCache(maxsize=1024, ttl=3600)
+
+    def authenticate(self, http_method, url, headers=None):
+        """
+        Authenticate a request, see :py:meth:`atlassian_jwt.Authenticator.authenticate`
+
+        :returns: client key and claims
+        :rtype: AuthResult
+        :raises DecodeError: if the token is missing or invalid"""
+        from atlassian_jwt.url_utils import parse_query_params
+
+        token = self._get_token(
+            headers=headers,
+            query_params=parse_query_params(url))
+        header, claims, signing_input, signature = _parse_token(token)
+        client_key = claims.get('iss')
+        if header.get('alg') not in self.algorithms:
+            raise _jwt_errors().DecodeError('Invalid token')
+        if not client_key or not isinstance(client_key, string_types):
+            raise _jwt_errors().DecodeError('Invalid token')
+        if claims.get('qsh') != self._hash_url(http_method, url):
+            raise _jwt_errors().DecodeError('qsh does not match')
+
+        self._verify(
+            header, claims, signing_input, signature,
+            client_key, self.get_shared_secret(client_key))
+        return AuthResult(client_key, claims)
+
+    def verify_token(self, token, shared_secret):
+        """
+        Verify a token's signature and time claims, but not its query
+        string hash
+
+        :returns: claims
+        :rtype: dict
+        :raises DecodeError: if the token is invalid"""
+        header, claims, signing_input, signature = _parse_token(token)
+        if header.get('alg') not in self.algorithms:
+            raise _jwt_errors().DecodeError('Invalid token')
+        if not isinstance(claims.get('iss'), string_types):
+            raise _jwt_errors().DecodeError('Invalid token')
+        self._verify(
+            header, claims, signing_input, signature,
+            claims.get('iss'), shared_secret)
+        return claims
+
+    def _verify(self, header, claims, signing_input, signature, client_key, shared_secret):
+        mac = self._hmac_key(client_key, header['alg'], shared_secret).copy()
+        mac.update(signing_input)
+        if not hmac.compare_digest(mac.digest(), signature):
+            raise _jwt_errors().DecodeError('Signature verification failed')
+
+        now = time.time()
+        try:
+            if 'exp' in claims and float(claims['exp']) < now - self.leeway:
+                raise _jwt_errors().ExpiredSignatureError('Signature has expired')
+            if 'nbf' in claims and float(claims['nbf']) > now + self.leeway:
+                raise _jwt_errors().ImmatureSignatureError('The token is not yet valid (nbf)')
+            if 'iat' in claims and float(claims['iat']) > now + self.leeway:
+                raise _jwt_errors().ImmatureSignatureError('The token is not yet valid (iat)')
+        except (TypeError, ValueError):
+            raise _jwt_errors().DecodeError('Invalid time claims')
+
+    def _hmac_key(self, client_key, alg, shared_secret):
+        """HMAC object keyed with the shared secret, copied for each token"""
+        if not isinstance(shared_secret, bytes):
+            shared_secret = shared_secret.encode('utf-8')
+        cache_key = (client_key, alg)
+        cached = self._hmac_keys.get(cache_key, None)
+        if cached is None or cached[0] != shared_secret:
+            cached = (shared_secret, hmac.new(shared_secret, digestmod=_HMAC_DIGESTS[alg]))
+            self._hmac_keys.set(cache_key, cached)
+        return cached[1]
+
+    def _hash_url(self, http_method, url):
+        cache_key = (http_method.upper(), url)
+        qsh = self._url_hashes.get(cache_key, None)
+        if qsh is None:
+            from atlassian_jwt.url_utils import hash_url
+            qsh = hash_url(http_method, url)
+            self._url_hashes.set(cache_key, qsh)
+        return qsh
+
+    @staticmethod
+    def _get_token(headers=None, query_params=None):
+        """
+        Find the token in the Authorization header or jwt query parameter
+
+        :raises DecodeError: if there is no token"""
+        from atlassian_jwt import Authenticator
+        return Authenticator._get_token(  # pylint: disable=protected-access
+            headers=headers, query_params=query_params)
+
+    def load_client(self, client_key):
+        """
+        Load a client from the addon's client_class.
+
+        While :py:meth:`authenticate_client` is running, each client key
+        is only looked up once and the loaded client is reused.
+
+        :param client_key:
+            jira/confluence clientKey to load
+        :type client_key: string
+        :rtype: Client or None"""
+        loaded = getattr(self._local, 'loaded', None)
+        if loaded is None:
+            return self.addon.client_class.load(client_key)
+        if client_key not in loaded:
+            before = self._store_loads()
+            timing = self._local.timing
+            if timing is None:
+                loaded[client_key] = self.addon.client_class.load(client_key)
+            else:
+                start = timing.clock()
+                loaded[client_key] = self.addon.client_class.load(client_key)
+                timing.add('load', timing.clock() - start)
+            if before is None:
+                self._local.lookups += 1
+            else:
+                # Cache hits don't count as store lookups
+                self._local.lookups += self._store_loads() - before
+        return loaded[client_key]
+
+    def _store_loads(self):
+        counter = getattr(self.addon.client_class, 'store_loads', None)
+        return counter() if counter is not None else None
+
+    def authenticate_client(self, http_method, url, headers=None, timing=None):
+        """
+        Authenticate a request and resolve its client in a single pass.
+
+        The client loaded to verify the JWT signature is the same one that
+        is handed back, so the store is only hit once per request.
+
+        :param timing: :py:class:`~chalice_atlassian_connect.metrics.RequestTiming`
+            the jwt and load stages are added to
+        :returns: client key, claims, loaded client and number of store lookups
+        :rtype: ClientAuthResult"""
+        self._local.loaded = {}
+        self._local.lookups = 0
+        self._local.timing = timing
+        if timing is not None:
+            start = timing.clock()
+            loading = timing.stages.get('load', 0.0)
+        try:
+            client_key, claims = self.authenticate(http_method, url, headers)
+            client = self.load_client(client_key)
+            return ClientAuthResult(
+                client_key, claims, client, self._local.lookups)
+        finally:
+            self._local.loaded = None
+            self._local.timing = None
+            if timing is not None:
+                loading = timing.stages.get('load', 0.0) - loading
+                timing.add('jwt', timing.clock() - start - loading)
 
     def get_shared_secret(self, client_key):
         """ I actually don't fully understand this. Go see atlassian_jwt """
-        client = self.addon.client_class.load(client_key)
+        client = self.load_client(client_key)
         if client is None:
-            raise Exception('No client for ' + client_key)
+            raise UnauthorizedError('No client for ' + client_key)
         if isinstance(client, dict):
             return client.get('sharedSecret')
         return client.sharedSecret
@@ -43,14 +295,64 @@ class AtlassianConnect(object):
     the authentication and authorization for you.
 
     You will need to provide a Client class that
-    contains load(id) and save(client) methods.
+    contains load(id) and save(client) methods. It is built with its
+    from_config(config) classmethod if it has one.
+
+    Pass a :py:class:`~chalice_atlassian_connect.cache.ClientCache` as
+    `client_cache` to keep loaded clients in memory between requests.
+
+    Outbound calls go through `http`, a
+    :py:class:`~chalice_atlassian_connect.session.HttpClient` built from
+    config if not provided.
+
+    With a `webhook_queue` (see :py:mod:`chalice_atlassian_connect.webhooks`)
+    webhook deliveries are authenticated, queued and acknowledged straight
+    away, and handled later by :py:meth:`process_webhooks`. A
+    :py:class:`~chalice_atlassian_connect.webhooks.WebhookDeduplicator` as
+    `webhook_dedup` acknowledges duplicated deliveries without handling them.
+
+    With `direct_routes`, each handler is registered as its own Chalice
+    route instead of going through a `{section}/{name}` route, so unknown
+    paths are turned away by Chalice's router.
+
+    Modules and webpanels decorated with a `cache_ttl` keep their responses
+    in `response_cache`, a
+    :py:class:`~chalice_atlassian_connect.cache.ResponseCache` made if
+    not provided.
+
+    With an `instrumentation`, a
+    :py:class:`~chalice_atlassian_connect.metrics.Instrumentation`, the
+    stages of each handled request are timed and reported.
+
+    Built with a `host`, an
+    :py:class:`~chalice_atlassian_connect.host.AddonHost`, the add-on is
+    served from the host's app alongside other add-ons, sharing its routes,
+    HttpClient and client cache.
     """
-    def __init__(self, app=None, client_class=AtlassianConnectClient, root_url='', config=None):
+    def __init__(self, app=None, client_class=AtlassianConnectClient, root_url='', config=None,
+                 client_cache=None, http=None, webhook_queue=None, webhook_dedup=None,
+                 direct_routes=False, response_cache=None, instrumentation=None, host=None):
+        if host is not None:
+            app = host.app
+            if http is None:
+                http = host.http
         self.app = app
+        self.host = host
+        self.instrumentation = instrumentation
+        self.direct_routes = direct_routes
+        self.response_cache = response_cache
+        self._cached_handlers = {}
+        self._rest_tokens = ClientCache(maxsize=1024)
+        self._post_urls = ClientCache(maxsize=1024)
         self.root_url = root_url
         if not config:
             config = {}
         self.config = config
+        if http is None:
+            http = HttpClient.from_config(config)
+        self.http = http
+        self.consumer_info = ConsumerInfoCache(
+            http, ttl=config.get('CONSUMER_INFO_TTL', 300))
 
         self.descriptor = {
             "authentication": {"type": "none"},
@@ -59,11 +361,39 @@ class AtlassianConnect(object):
             "links": {
             },
         }
+        self._descriptor_cache = {}
+        self._url_index = None
+        self._url_index_size = 0
+        self.sections = {}
         if app is not None:
             self.init_app(app=app, root_url=root_url, config=config)
-        self.client_class = client_class()
+        from_config = getattr(client_class, 'from_config', None)
+        self.client_class = from_config(config) if from_config else client_class()
+        if client_cache is None and host is not None and host.client_cache is not None:
+            client_cache = host.client_cache.partition(config['ADDON_KEY'])
+        if client_cache is not None:
+            self.client_class = CachedClient(self.client_class, client_cache)
         self.auth = _SimpleAuthenticator(addon=self)
-        self.sections = {}
+        self.webhook_queue = webhook_queue
+        self.webhook_dedup = webhook_dedup
+        self._webhook_handlers = {}
+
+    def rest(self, client):
+        """
+        Signed REST client for calls back to a client's Jira/Confluence
+
+        Example::
+
+            @ac.webhook("jira:issue_created")
+            def jira_issue_created(client, event):
+                ac.rest(client).post(
+                    '/rest/api/2/issue/%s/comment' % event['issue']['key'],
+                    json={'body': 'Thanks!'})
+
+        :param client: installed client, as handed to handlers
+        :rtype: :py:class:`~chalice_atlassian_connect.rest.AtlassianRestClient`"""
+        return AtlassianRestClient(
+            client, self.config['ADDON_KEY'], self.http, tokens=self._rest_tokens)
 
     def init_app(self, app, root_url, config):
         """
@@ -76,14 +406,21 @@ class AtlassianConnect(object):
         if self.app is not None:
             self.app = app
 
-        if not hasattr(app, 'root_urls'):
-            app.root_urls = []
-
-        app.root_urls.append(root_url)
-        app.route('%s/atlassian-connect.json' % root_url,
-                  methods=['GET'])(self._get_descriptor)
-        app.route('%s/{section}/{name}' % root_url,
-                  methods=['GET', 'POST'])(self._handler_router)
+        if self.host is not None:
+            self.host.add(self, root_url)
+        else:
+            if not hasattr(app, 'root_urls'):
+                app.root_urls = []
+            app.root_urls.append(root_url)
+            app.route('%s/atlassian-connect.json' % root_url,
+                      methods=['GET'])(self._get_descriptor)
+        if self.direct_routes:
+            for section, handlers in self.sections.items():
+                for name, handler in handlers.items():
+                    self._route_handler(app, section, name, handler)
+        elif self.host is None:
+            app.route('%s/{section}/{name}' % root_url,
+                      methods=['GET', 'POST'])(self._handler_router)
         if not hasattr(app, 'context_processor'):
             app.context_processor = self._atlassian_jwt_post_token
 
@@ -98,26 +435,31 @@ class AtlassianConnect(object):
             },
         }
         self.descriptor.update(app_descriptor)
+        self._descriptor_changed()
 
     def url_for(self, endpoint, **values):
-        reqctx = self.app.current_request
+        """
+        Build the url for a view, similar to flask's url_for
+
+        Path parameters are filled in from `values`, anything left over is
+        added as a query string.
+
+        :param endpoint: view name the route was registered with
+        :param _external: include scheme and host
+        :param _method: only match routes allowing this method
+        :param _scheme: scheme to use for external urls
+        """
+        reqctx = getattr(self.app, 'current_request', None)
 
         external = values.pop('_external', False)
         method = values.pop('_method', None)
         scheme = values.pop('_scheme', None)
-        rv = None
-        for k, v in self.app.routes.items():
-            if method is not None:
-                x = v.get(method)
-                if x and x.view_name == endpoint:
-                    rv = k
-            else:
-                for x in v.values():
-                    if x.view_name == endpoint:
-                        rv = k
+        rv = self._lookup_route(endpoint, method)
 
         if rv is None:
-            return ChaliceViewError("url not found for '%s'" % endpoint)
+            raise ChaliceViewError("url not found for '%s'" % endpoint)
+        if '{' in rv or values:
+            rv = self._build_path(endpoint, rv, values)
 
         if external:
             if reqctx is None:
@@ -132,35 +474,144 @@ class AtlassianConnect(object):
 
         return rv
 
+    def _lookup_route(self, endpoint, method=None):
+        """Find the path for a view name using the reverse route index
+
+        The index is built lazily and rebuilt when routes are added."""
+        if self._url_index is None or self._url_index_size != len(self.app.routes):
+            self._build_url_index()
+        rv = self._url_index.get((endpoint, method))
+        if rv is None:
+            # A new method may have been added to an existing path
+            self._build_url_index()
+            rv = self._url_index.get((endpoint, method))
+        return rv
+
+    def _build_url_index(self):
+        index = {}
+        for path, entries in self.app.routes.items():
+            for entry_method, entry in entries.items():
+                index.setdefault((entry.view_name, entry_method), path)
+                index.setdefault((entry.view_name, None), path)
+        self._url_index = index
+        self._url_index_size = len(self.app.routes)
+
+    @staticmethod
+    def _build_path(endpoint, path, values):
+        def _replace(match):
+            name = match.group(1)
+            greedy = name.endswith('+')
+            name = name.rstrip('+')
+            if name not in values:
+                raise ChaliceViewError(
+                    "Could not build url for '%s', missing '%s'" % (endpoint, name))
+            return quote(str(values.pop(name)), safe='/' if greedy else '')
+        path = _PATH_PARAM.sub(_replace, path)
+        if values:
+            path = path + '?' + urlencode(sorted(values.items()))
+        return path
+
+    def post_url(self, client=None, path=None, query_params=None):
+        """
+        Url a form posts back to, signed for the client with a jwt query
+        parameter. Chalice has no context processors, so handlers rendering
+        their own templates pass this on as ``atlassian_jwt_post_url``.
+
+        Urls are reused for the same client, path and query parameters
+        while their token has at least half of POST_TOKEN_TTL (default an
+        hour) left.
+
+        Example::
+
+            @ac.module(key="configurePage")
+            def configure_page(client):
+                return render(form_url=ac.post_url())
+
+        :param client: defaults to the current request's client
+        :param path: defaults to the current request's path
+        :param query_params: defaults to the current request's, any jwt
+            parameter is left out
+        :rtype: string"""
+        request = self.app.current_request
+        if client is None:
+            client = request.ac_client
+        if path is None:
+            path = request.context['path']
+        if query_params is None:
+            query_params = request.query_params or {}
+
+        pairs = []
+        for name in sorted(query_params):
+            if name == 'jwt':
+                continue
+            if hasattr(query_params, 'getlist'):
+                pairs.extend((name, value) for value in query_params.getlist(name))
+            else:
+                pairs.append((name, query_params[name]))
+        url = path + '?' + urlencode(pairs)
+
+        cache_key = (client.clientKey, client.sharedSecret, url)
+        signed = self._post_urls.get(cache_key, None)
+        if signed is None:
+            from atlassian_jwt import encode_token
+            ttl = self.config.get('POST_TOKEN_TTL', 3600)
+            token = encode_token(
+                'POST', url, client.clientKey, client.sharedSecret, timeout_secs=ttl)
+            signed = url + ('&' if pairs else '') + urlencode([('jwt', token)])
+            self._post_urls.set(cache_key, signed, ttl // 2)
+        return signed
+
     def _atlassian_jwt_post_token(self):
         if not getattr(self.app.current_request, 'ac_client', None):
             return dict()
-
-        _args = {}
-        if self.app.current_request.query_params:
-            _args = self.app.current_request.query_params.copy()
-        try:
-            del _args['jwt']
-        except KeyError:
-            pass
-
-        signature = encode_token(
-            'POST',
-            self.app.current_request.context['path'] + '?' + urlencode(_args),
-            self.app.current_request.ac_client.clientKey,
-            self.app.current_request.ac_client.sharedSecret
-        )
-        _args['jwt'] = signature
-        return dict(atlassian_jwt_post_url=self.app.current_request.context.path + '?' + urlencode(_args))
+        return dict(atlassian_jwt_post_url=self.post_url())
 
     def _get_descriptor(self):
-        """Output atlassian connector descriptor file"""
-        descriptor_external_link = self.url_for('_get_descriptor', _external=True)
-        descriptor_internal_link = self.url_for('_get_descriptor', _external=False)
-        self.descriptor["baseUrl"] = descriptor_external_link.replace(
+        """Output atlassian connector descriptor file
+
+        The descriptor is serialized once per scheme/host and served from
+        cache with an ETag, answering If-None-Match with a 304."""
+        headers = self.app.current_request.headers
+        cache_key = (headers.get('x-forwarded-proto', 'http'), headers.get('host'))
+        cached = self._descriptor_cache.get(cache_key)
+        if cached is None:
+            cached = self._serialize_descriptor()
+            if len(self._descriptor_cache) >= _DESCRIPTOR_CACHE_SIZE:
+                self._descriptor_cache.clear()
+            self._descriptor_cache[cache_key] = cached
+        body, etag = cached
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match and _etag_matches(etag, if_none_match):
+            return Response(body='', status_code=304, headers={'ETag': etag})
+        return Response(
+            body=body,
+            status_code=200,
+            headers={'Content-Type': 'application/json', 'ETag': etag})
+
+    def _serialize_descriptor(self):
+        """Render the descriptor for the current request's host
+
+        :returns: serialized descriptor and its ETag
+        :rtype: tuple"""
+        if self.host is None:
+            endpoint, values = '_get_descriptor', {}
+        else:
+            endpoint, values = '_hosted_descriptor', {'addon': self.root_url.strip('/')}
+        descriptor_external_link = self.url_for(endpoint, _external=True, **values)
+        descriptor_internal_link = self.url_for(endpoint, _external=False, **values)
+        descriptor = dict(self.descriptor)
+        descriptor["baseUrl"] = descriptor_external_link.replace(
             descriptor_internal_link, '')
-        self.descriptor["links"]["self"] = descriptor_external_link
-        return self.descriptor
+        descriptor["links"] = dict(
+            self.descriptor["links"], self=descriptor_external_link)
+        body = json.dumps(descriptor, separators=(',', ':'), sort_keys=True)
+        etag = '"%s"' % sha1(body.encode('utf-8')).hexdigest()
+        return body, etag
+
+    def _descriptor_changed(self):
+        """Drop serialized descriptors after a decorator registers something"""
+        self._descriptor_cache.clear()
 
     def _handler_router(self, section, name):
         """
@@ -170,9 +621,7 @@ class AtlassianConnect(object):
         """
         method = self.sections.get(section, {}).get(name)
         if method is None:
-            self.app.log.error(
-                'Invalid handler for %s -- %s' % (section, name))
-            print((section, name, self.sections))
+            self.app.log.debug('Invalid handler for %s -- %s', section, name)
             raise NotFoundError
         ret = method()
         if ret is not None:
@@ -182,35 +631,143 @@ class AtlassianConnect(object):
     def _make_path(self, section, name):
         return "/".join([self.root_url, section, name])
 
-    def _provide_client_handler(self, section, name, kwargs_updator=None):
-        def _wrapper(func):
-            @wraps(func)
-            def _handler(**kwargs):
-                try:
-                    client_key = self.auth.authenticate(
-                        self.app.current_request.method,
-                        self.app.current_request.context['path'],
-                        self.app.current_request.headers)
-                    client = self.client_class.load(client_key)
-                    if not client:
-                        raise UnauthorizedError
-                    self.app.current_request.ac_client = client
-                    kwargs['client'] = client
-                    if kwargs_updator:
-                        kwargs.update(kwargs_updator(**kwargs))
-                except DecodeError:
-                    pass
+    def _provide_client_handler(self, section, name, kwargs_updator=None, cache_ttl=None):
+        cached = None
+        if cache_ttl is not None:
+            if self.response_cache is None:
+                self.response_cache = ResponseCache()
+            cached = '%s/%s' % (section, name)
+            self._cached_handlers[cached] = name
 
-                ret = func(**kwargs)
-                if ret is not None:
-                    return ret
-                return Response(status_code=204, body={})
-            self._add_handler(section, name, _handler)
+        def _wrapper(func):
+            self._add_handler(
+                section, name, self._client_handler(func, kwargs_updator, cached, cache_ttl))
             return func
         return _wrapper
 
+    def _client_handler(self, func, kwargs_updator=None, cached=None, cache_ttl=None):
+        @wraps(func)
+        def _handler(**kwargs):
+            timing = getattr(self.app.current_request, 'ac_timing', None)
+            try:
+                result = self.auth.authenticate_client(
+                    self.app.current_request.method,
+                    self.app.current_request.context['path'],
+                    self.app.current_request.headers,
+                    timing=timing)
+                if timing is not None:
+                    timing.client_key = result.client_key
+                self.app.current_request.ac_store_lookups = result.lookups
+                client = result.client
+                if not client:
+                    raise UnauthorizedError
+                self.app.current_request.ac_client = client
+                kwargs['client'] = client
+                if kwargs_updator:
+                    kwargs.update(kwargs_updator(**kwargs))
+            except _jwt_errors().DecodeError:
+                pass
+
+            if timing is not None:
+                start = timing.clock()
+            if cached and 'client' in kwargs and self.app.current_request.method == 'GET':
+                ret = self._cached_response(cached, cache_ttl, func, kwargs)
+            else:
+                ret = func(**kwargs)
+            if timing is not None:
+                timing.add('handler', timing.clock() - start)
+            if ret is not None:
+                return ret
+            return Response(status_code=204, body={})
+        return _handler
+
+    def _cached_response(self, handler, ttl, func, kwargs):
+        query_params = self.app.current_request.query_params
+        client_key = kwargs['client'].clientKey
+        generation, ret = self.response_cache.lookup(client_key, handler, query_params)
+        if ret is _MISSING:
+            ret = func(**kwargs)
+            if ret is not None and getattr(ret, 'status_code', 200) == 200:
+                self.response_cache.store(
+                    client_key, handler, query_params, generation, ret, ttl)
+        return ret
+
+    def invalidate_responses(self, client_key, key=None):
+        """
+        Forget a client's cached module and webpanel responses, only those
+        of the module or webpanel `key` if given
+
+        Example::
+
+            @ac.webhook("jira:issue_updated")
+            def jira_issue_updated(client, event):
+                ac.invalidate_responses(client.clientKey, "userPanel")
+
+        :param client_key: jira/confluence clientKey
+        :param key: module or webpanel key"""
+        for handler, name in self._cached_handlers.items():
+            if key is None or name == key:
+                self.response_cache.invalidate(client_key, handler)
+
     def _add_handler(self, section, name, handler):
+        if self.instrumentation is not None:
+            handler = self._instrumented(section, name, handler)
         self.sections.setdefault(section, {})[name] = handler
+        if self.direct_routes and self.app is not None:
+            self._route_handler(self.app, section, name, handler)
+
+    def _instrumented(self, section, name, handler):
+        """
+        Time a handler's request, serializing its response so that can be
+        timed as well"""
+        instrumentation = self.instrumentation
+
+        @wraps(handler)
+        def _timed(*args, **kwargs):
+            request = self.app.current_request
+            timing = instrumentation.start(section, name)
+            request.ac_timing = timing
+            start = timing.clock()
+            try:
+                ret = handler(*args, **kwargs)
+                if ret is None:
+                    ret = Response(status_code=204, body={})
+                elif not isinstance(ret, Response):
+                    ret = Response(body=ret, headers={'Content-Type': 'application/json'})
+                serialize = timing.clock()
+                if not isinstance(ret.body, (type(u''), bytes)):
+                    ret.body = json.dumps(
+                        ret.body, separators=(',', ':'), default=handle_extra_types)
+                    ret.headers.setdefault('Content-Type', 'application/json')
+                now = timing.clock()
+                timing.add('serialize', now - serialize)
+                timing.add('total', now - start)
+                timing.status_code = ret.status_code
+                if instrumentation.server_timing:
+                    ret.headers['Server-Timing'] = timing.server_timing()
+                return ret
+            except Exception as e:
+                timing.add('total', timing.clock() - start)
+                timing.status_code = getattr(e, 'STATUS_CODE', 500)
+                raise
+            finally:
+                request.ac_timing = None
+                try:
+                    instrumentation.emit(timing)
+                except Exception:  # pylint: disable=broad-except
+                    self.app.log.exception('Reporting timings of %s/%s failed', section, name)
+        return _timed
+
+    def _route_handler(self, app, section, name, handler):
+        """Register a handler as its own route, allowing only the methods it needs"""
+        @wraps(handler)
+        def _view():
+            ret = handler()
+            if ret is not None:
+                return ret
+            return Response(status_code=204, body={})
+        app.route(self._make_path(section, name),
+                  methods=_SECTION_METHODS.get(section, ['GET', 'POST']))(_view)
 
     def lifecycle(self, name):
         """
@@ -258,6 +815,7 @@ class AtlassianConnect(object):
         self.descriptor.setdefault(
             section, {}
         )[name] = self._make_path(section, name)
+        self._descriptor_changed()
 
         def _decorator(func):
             if name == "installed":
@@ -275,46 +833,83 @@ class AtlassianConnect(object):
             json_body = self.app.current_request.json_body
             if json_body is None:
                 raise Exception("Invalid Credentials")
-            client = self.client_class
-            client.__init__(**json_body)
-            response = get(
-                client.baseUrl.rstrip('/') +
-                '/plugins/servlet/oauth/consumer-info')
-            response.raise_for_status()
-
-            key = re.search(r"<key>(.*)</key>", response.text).groups()[0]
-            public_key = re.search(
-                r"<publicKey>(.*)</publicKey>", response.text
-            ).groups()[0]
-
+            client = ClientRecord(**json_body)
+            key, public_key = self.consumer_info.get(client.baseUrl)
             if key != client.clientKey or public_key != client.publicKey:
+                self.consumer_info.invalidate(client.baseUrl)
                 raise Exception("Invalid Credentials")
 
-            stored_client = self.client_class.load(client.clientKey)
-            if stored_client:
-                token = self.app.current_request.headers.get('authorization', '').lstrip('JWT ')
-                if not token:
-                    # Is not first install, but did not sign the request
-                    # properly for an update
-                    raise UnauthorizedError
-                try:
-                    decode(
-                        token,
-                        stored_client.sharedSecret,
-                        options={"verify_aud": False})
-                except (ValueError, DecodeError):
-                    # Invalid secret, so things did not get installed
-                    raise UnauthorizedError
-
-            self.client_class.save(client)
+            store = getattr(self.client_class, 'wrapped', self.client_class)
+            if hasattr(store, 'save_if'):
+                client = self._save_installed(client)
+            else:
+                stored_client = store.load(client.clientKey)
+                if stored_client:
+                    self._verify_reinstall(stored_client)
+                self.client_class.save(client)
             kwargs['client'] = client
             return func(*args, **kwargs)
         return inner
 
+    def _save_installed(self, client):
+        """
+        Save an installed client with a conditional write. An unsigned
+        request can only be a first install and takes a single write, a
+        signed one reads the stored client to verify it first.
+
+        The stored client is read past any cache, both the secret the
+        request is verified with and the version written against must be
+        the store's own.
+
+        :raises ConflictError: if another request changed the client
+            between reading and writing it"""
+        try:
+            self.auth._get_token(headers=self.app.current_request.headers)
+        except _jwt_errors().DecodeError:
+            try:
+                return self.client_class.save_if(client, None)
+            except VersionConflict:
+                # Is not first install, but did not sign the request
+                # properly for an update
+                raise UnauthorizedError
+
+        store = getattr(self.client_class, 'wrapped', self.client_class)
+        stored_client = store.load(client.clientKey)
+        expected_version = None
+        if stored_client:
+            self._verify_reinstall(stored_client)
+            expected_version = getattr(stored_client, 'version', 0)
+        try:
+            return self.client_class.save_if(client, expected_version)
+        except VersionConflict:
+            raise ConflictError(
+                '%s was installed by another request' % client.clientKey)
+
+    def _verify_reinstall(self, stored_client):
+        try:
+            token = self.auth._get_token(
+                headers=self.app.current_request.headers)
+        except _jwt_errors().DecodeError:
+            # Is not first install, but did not sign the request
+            # properly for an update
+            raise UnauthorizedError
+        try:
+            self.auth.verify_token(token, stored_client.sharedSecret)
+        except _jwt_errors().InvalidTokenError:
+            # Invalid secret, so things did not get installed
+            raise UnauthorizedError
+
     def _uninstalled_wrapper(self, func):
         @wraps(func)
         def inner(*args, **kwargs):
-            self.client_class.delete(self.client_class.clientKey)
+            try:
+                result = self.auth.authenticate_client(
+                    self.app.current_request.method,
+                    self.app.current_request.context['path'],
+                    self.app.current_request.headers)
+            except _jwt_errors().InvalidTokenError:
+                raise UnauthorizedError
+            self.client_class.delete(result.client_key)
             return func(*args, **kwargs)
         return inner
 
@@ -370,16 +965,162 @@ class AtlassianConnect(object):
         ).setdefault(
             section, []
         ).append(webhook)
+        self._descriptor_changed()
+
+        name = event.replace(":", "")
+        if self.webhook_queue is not None:
+            def _decorator(func):
+                self._webhook_handlers[event] = func
+                self._add_handler(
+                    section, name, self._deduplicated(event, self._queue_webhook(event)))
+                return func
+            return _decorator
 
         def _wrapper(**kwargs):
             del kwargs
-            content = self.app.current_request.json_body()
+            self._claim_delivery()
+            content = self.app.current_request.json_body
             return {"event": content}
 
-        return self._provide_client_handler(
-            section, event.replace(":", ""), kwargs_updator=_wrapper)
+        def _decorator(func):
+            self._add_handler(
+                section, name, self._deduplicated(event, self._client_handler(func, _wrapper)))
+            return func
+        return _decorator
+
+    def _deduplicated(self, event, handler):
+        """
+        Acknowledge duplicated deliveries of a webhook without handling them.
+
+        Deliveries this process already saw are answered before the request
+        is authenticated, handlers claim a delivery once it is.
+        """
+        if self.webhook_dedup is None:
+            return handler
+
+        @wraps(handler)
+        def _handler():
+            request = self.app.current_request
+            key = self._delivery_key(event)
+            if key is not None and self.webhook_dedup.seen(key):
+                return Response(status_code=204, body={})
+            request.ac_delivery_key = key
+            try:
+                return handler()
+            except _DuplicateDelivery:
+                return Response(status_code=204, body={})
+            except Exception:
+                if getattr(request, 'ac_delivery_claimed', False):
+                    # Let Atlassian's retry through
+                    self.webhook_dedup.release(key)
+                raise
+        return _handler
+
+    def _delivery_key(self, event):
+        """Issuer and delivery id of the current webhook request, None without a token"""
+        request = self.app.current_request
+        try:
+            token = self.auth._get_token(
+                headers=request.headers, query_params=request.query_params)
+            client_key = _parse_token(token)[1].get('iss')
+        except _jwt_errors().DecodeError:
+            return None
+        delivery_id = request.headers.get('x-atlassian-webhook-identifier')
+        if not delivery_id:
+            delivery_id = sha256(event.encode('utf-8') + (request.raw_body or b'')).hexdigest()
+        return '%s:%s' % (client_key, delivery_id)
+
+    def _claim_delivery(self):
+        """Claim the authenticated webhook delivery being handled"""
+        request = self.app.current_request
+        key = getattr(request, 'ac_delivery_key', None)
+        if key is None:
+            return
+        if not self.webhook_dedup.claim(key):
+            raise _DuplicateDelivery
+        request.ac_delivery_claimed = True
+
+    def _queue_webhook(self, event):
+        def _handler():
+            request = self.app.current_request
+            try:
+                result = self.auth.authenticate_client(
+                    request.method, request.context['path'], request.headers)
+            except _jwt_errors().InvalidTokenError:
+                raise UnauthorizedError
+            if not result.client:
+                raise UnauthorizedError
+            self._claim_delivery()
+            self.webhook_queue.put(json.dumps({
+                'event': event,
+                'clientKey': result.client_key,
+                'body': request.json_body,
+            }))
+            return Response(status_code=204, body={})
+        return _handler
+
+    def process_webhooks(self, batch_size=10, max_batches=None):
+        """
+        Worker entry point, handles queued webhook deliveries in batches
+        until the queue is empty or `max_batches` batches were handled.
+
+        The clients of a batch are loaded together. Deliveries whose
+        handler raised are left on the queue to be retried once their
+        visibility timeout runs out.
 
-    def module(self, key, name=None, location=None):
+        Example::
+
+            @app.schedule(Rate(1, unit=Rate.MINUTES))
+            def webhook_worker(event):
+                ac.process_webhooks()
+
+        :returns: number of deliveries handled
+        :rtype: int"""
+        handled = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            messages = self.webhook_queue.receive(batch_size)
+            if not messages:
+                break
+            batches += 1
+            done = self._dispatch_webhooks(messages)
+            self.webhook_queue.delete(done)
+            handled += len(done)
+        return handled
+
+    def _dispatch_webhooks(self, messages):
+        """Run handlers for (receipt, body) pairs, returning the receipts done with"""
+        deliveries = []
+        done = []
+        for receipt, body in messages:
+            try:
+                deliveries.append((receipt, json.loads(body)))
+            except ValueError:
+                self.app.log.error('Dropping malformed webhook delivery %r' % (body,))
+                done.append(receipt)
+        client_keys = set(delivery['clientKey'] for _, delivery in deliveries)
+        if hasattr(self.client_class, 'load_many'):
+            clients = self.client_class.load_many(client_keys)
+        else:
+            clients = dict((k, self.client_class.load(k)) for k in client_keys)
+        for receipt, delivery in deliveries:
+            handler = self._webhook_handlers.get(delivery['event'])
+            client = clients.get(delivery['clientKey'])
+            if handler is None or client is None:
+                self.app.log.error('Dropping %s webhook for %s' % (
+                    delivery['event'], delivery['clientKey']))
+                done.append(receipt)
+                continue
+            try:
+                handler(client=client, event=delivery['body'])
+            except Exception:  # pylint: disable=broad-except
+                self.app.log.exception('%s webhook for %s failed' % (
+                    delivery['event'], delivery['clientKey']))
+                continue
+            done.append(receipt)
+        return done
+
+    def module(self, key, name=None, location=None, cache_ttl=None):
         """
         Module decorator. See `external modules`_ documentation
 
@@ -411,6 +1152,12 @@ class AtlassianConnect(object):
             A human readable name.
         :type event: string
 
+        :param cache_ttl:
+            Seconds to reuse the response for GET requests from the same
+            client with the same query parameters, not cached if None.
+            See :py:meth:`invalidate_responses`.
+        :type cache_ttl: int
+
         .. _external modules: https://developer.atlassian.com/static/connect/docs/beta/modules/common/web-section.html
         """
         name = name or key
@@ -424,8 +1171,9 @@ class AtlassianConnect(object):
             "name": {"value": name},
             "key": key
         }
+        self._descriptor_changed()
 
-        return self._provide_client_handler(section, key)
+        return self._provide_client_handler(section, key, cache_ttl=cache_ttl)
 
     def blueprint(self, key, description, name=None, **kwargs):
         """
@@ -492,6 +1240,7 @@ class AtlassianConnect(object):
         ).setdefault(
             section, []
         ).append(blueprint)
+        self._descriptor_changed()
         return self._provide_client_handler(section, key)
 
     def blueprint_context(self, key, **kwargs):
@@ -536,9 +1285,10 @@ class AtlassianConnect(object):
         my_blueprint[0]['template'].update(blueprint_context)
         registered_blueprints = my_blueprint + other_blueprints
         self.descriptor['modules']['blueprints'] = registered_blueprints
+        self._descriptor_changed()
         return self._provide_client_handler(section, key)
 
-    def webpanel(self, key, name=None, location=None, query_params=None, **kwargs):
+    def webpanel(self, key, name=None, location=None, query_params=None, cache_ttl=None, **kwargs):
         """
         Webpanel decorator. See `external webpanel`_ documentation
 
@@ -577,6 +1327,12 @@ class AtlassianConnect(object):
             A human readable name.
         :type event: string
 
+        :param cache_ttl:
+            Seconds to reuse the response for GET requests from the same
+            client with the same query parameters, not cached if None.
+            See :py:meth:`invalidate_responses`.
+        :type cache_ttl: int
+
         Anything else from the `external webpanel`_ docs should also work
 
         .. _external webpanel: https://developer.atlassian.com/static/connect/docs/beta/modules/common/web-panel.html
@@ -606,7 +1362,8 @@ class AtlassianConnect(object):
         ).setdefault(
             section, []
         ).append(webpanel_capability)
-        return self._provide_client_handler(section, key)
+        self._descriptor_changed()
+        return self._provide_client_handler(section, key, cache_ttl=cache_ttl)
 
     def tasks(self):
         """Function that turns a collection of tasks
@@ -623,36 +1380,32 @@ class AtlassianConnect(object):
         from invoke import task, Collection
 
         @task
-        def list(ctx):
-            """Show all clients in the database"""
+        def list(ctx, segments=1):
+            """Show all clients in the database, one JSON document per line"""
             from json import dumps
-            with self.app.app_context():
-                print(dumps([
-                    dict(c) for c in self.client_class.all()
-                ]))
+            kwargs = {'total_segments': segments} if segments > 1 else {}
+            for c in self.client_class.all(**kwargs):
+                print(dumps(dict(c)))
 
         @task
         def show(ctx, clientKey):
             """Lookup one client from the database"""
             from json import dumps
-            with self.app.app_context():
-                print(dumps(dict(self.client_class.load(clientKey))))
+            print(dumps(dict(self.client_class.load(clientKey))))
 
         @task
         def install(ctx, data):
             """Add a given client from the database"""
             from json import loads
-            with self.app.app_context():
-                client = loads(data)
-                self.client_class.save(client)
-                print("Added")
+            client = loads(data)
+            self.client_class.save(client)
+            print("Added")
 
         @task()
         def uninstall(ctx, clientKey):
             """Remove a given client from the database"""
-            with self.app.app_context():
-                self.client_class.delete(clientKey)
-                print("Deleted")
+            self.client_class.delete(clientKey)
+            print("Deleted")
 
         ns = Collection('clients')
         ns.add_task(list)
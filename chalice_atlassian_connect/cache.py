@@ -0,0 +1,497 @@
+"""Caching helpers so warm containers don't go to the store on every request"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .client import ClientRecord
+
+_MISSING = object()
+
+_CONSUMER_KEY = re.compile(r"<key>(.*?)</key>", re.S)
+_CONSUMER_PUBLIC_KEY = re.compile(r"<publicKey>(.*?)</publicKey>", re.S)
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*(\d+)", re.I)
+_NO_STORE = re.compile(r"(?:^|,)\s*(?:no-store|no-cache|private)\b", re.I)
+
+
+class ClientCache(object):
+    """
+    Bounded LRU cache with per entry TTL.
+
+    Unknown client keys are remembered too (negative caching) but for
+    a shorter period of time.
+
+    :param maxsize: Maximum number of entries kept before evicting
+    :param ttl: Seconds a loaded client is kept
+    :param negative_ttl: Seconds an unknown client key is kept
+    :param timer: Function returning the current time in seconds
+    """
+    def __init__(self, maxsize=1024, ttl=300, negative_ttl=30, timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timer = timer
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=_MISSING):
+        """
+        Look up a key
+
+        :returns: cached value (which may be None for unknown clients),
+            or `default` if nothing usable is cached"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self.timer():
+                    self._entries.pop(key)
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entry if full"""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self.timer() + ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """Forget a single key"""
+        with self._lock:
+            if self._entries.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        """Forget everything"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def partition(self, name):
+        """
+        View of the cache whose keys are kept apart from other partitions',
+        sharing its size and counters
+
+        :rtype: CachePartition"""
+        return CachePartition(self, name)
+
+    def stats(self):
+        """
+        Counters suitable for shipping to a metrics system
+
+        :rtype: dict"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'size': len(self._entries),
+            }
+
+
+class CachePartition(object):
+    """
+    Part of a :py:class:`ClientCache`, see :py:meth:`ClientCache.partition`
+
+    :param cache: the shared ClientCache
+    :param name: prefixed to every key
+    """
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+
+    def get(self, key, default=_MISSING):
+        return self.cache.get((self.name, key), default)
+
+    def set(self, key, value, ttl=None):
+        self.cache.set((self.name, key), value, ttl)
+
+    def invalidate(self, key):
+        self.cache.invalidate((self.name, key))
+
+
+class CachedClient(object):
+    """
+    Wraps any client class instance (load/save/delete/all) with a
+    :py:class:`ClientCache`.
+
+    save and delete invalidate the cached entry so things like a rotated
+    sharedSecret are picked up on the very next request.
+
+    Example::
+
+        ac = AtlassianConnect(
+            app, client_class=DynamoDBAtlassianConnectClient,
+            client_cache=ClientCache(maxsize=512, ttl=600))
+
+    :param wrapped: client class instance to cache
+    :param cache: :py:class:`ClientCache` to use, a default one if not provided
+    """
+    def __init__(self, wrapped, cache=None):
+        if cache is None:
+            cache = ClientCache()
+        self.wrapped = wrapped
+        self.cache = cache
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if name in ('wrapped', '_local'):
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+    def load(self, client_key):
+        """
+        Loads a Client, from the cache if possible
+
+        :param client_key:
+            jira/confluence clientKey to load
+        :type client_key: string
+        :rtype: Client or None"""
+        client = self.cache.get(client_key)
+        if client is _MISSING:
+            self._local.store_loads = self.store_loads() + 1
+            client = self.wrapped.load(client_key)
+            self.cache.set(client_key, client)
+        return client
+
+    def store_loads(self):
+        """
+        Number of loads the current thread had to pass on to the store
+
+        :rtype: int"""
+        return getattr(self._local, 'store_loads', 0)
+
+    def load_many(self, client_keys):
+        """
+        Loads several Clients, only asking the store for the ones that
+        are not cached
+
+        :param client_keys:
+            jira/confluence clientKeys to load
+        :type client_keys: iterable
+        :returns: loaded clients by clientKey, unknown keys are left out
+        :rtype: dict"""
+        clients = {}
+        missing = []
+        for client_key in client_keys:
+            client = self.cache.get(client_key)
+            if client is _MISSING:
+                missing.append(client_key)
+            elif client is not None:
+                clients[client_key] = client
+        if missing:
+            if hasattr(self.wrapped, 'load_many'):
+                loaded = self.wrapped.load_many(missing)
+            else:
+                loaded = dict((k, self.wrapped.load(k)) for k in missing)
+            for client_key in missing:
+                client = loaded.get(client_key)
+                self.cache.set(client_key, client)
+                if client is not None:
+                    clients[client_key] = client
+        return clients
+
+    def save(self, client):
+        """
+        Save a client and drop any cached copy of it
+
+        :param client:
+            Client object (ClientRecord, dict or overriden class) to save
+        :type client: Client"""
+        client = ClientRecord.from_client(client)
+        try:
+            return self.wrapped.save(client)
+        finally:
+            self.cache.invalidate(client.clientKey)
+
+    def save_if(self, client, expected_version=None):
+        """
+        Conditionally save a client, see
+        :py:meth:`~chalice_atlassian_connect.client.AtlassianConnectClient.save_if`,
+        and drop any cached copy of it
+
+        :rtype: ClientRecord"""
+        client = ClientRecord.from_client(client)
+        try:
+            return self.wrapped.save_if(client, expected_version)
+        finally:
+            self.cache.invalidate(client.clientKey)
+
+    def delete(self, client_key):
+        """
+        Removes a client and drop any cached copy of it
+
+        :param client_key:
+            jira/confluence clientKey to remove
+        :type client_key: string"""
+        try:
+            return self.wrapped.delete(client_key)
+        finally:
+            self.cache.invalidate(client_key)
+
+    def invalidate(self, client_key):
+        """Drop a cached client without touching the store"""
+        self.cache.invalidate(client_key)
+
+    def all(self, total_segments=1):
+        """Always served from the store"""
+        if total_segments > 1:
+            return self.wrapped.all(total_segments=total_segments)
+        return self.wrapped.all()
+
+
+def _cache_control_ttl(headers, default):
+    """Seconds a response may be reused for according to Cache-Control"""
+    cache_control = headers.get('Cache-Control')
+    if not cache_control:
+        return default
+    if _NO_STORE.search(cache_control):
+        return 0
+    max_age = _MAX_AGE.search(cache_control)
+    if max_age:
+        return int(max_age.group(1))
+    return default
+
+
+class ConsumerInfoCache(object):
+    """
+    Remembers the (key, publicKey) an instance's consumer-info reports,
+    so repeated installed callbacks from the same baseUrl skip the round trip.
+
+    Cache-Control max-age and no-store/no-cache are honoured when the
+    instance sends them, `ttl` is used otherwise.
+
+    :param http: :py:class:`~chalice_atlassian_connect.session.HttpClient`
+    :param cache: :py:class:`ClientCache` to keep entries in
+    :param ttl: Seconds an entry is kept without caching headers
+    """
+    def __init__(self, http, cache=None, ttl=300):
+        if cache is None:
+            cache = ClientCache(maxsize=256, ttl=ttl)
+        self.http = http
+        self.cache = cache
+        self.ttl = ttl
+
+    def get(self, base_url):
+        """
+        Fetch the consumer key and public key for an instance
+
+        :param base_url: Url for Confluence/Jira/Etc
+        :returns: consumer key and public key
+        :rtype: tuple"""
+        base_url = base_url.rstrip('/')
+        consumer = self.cache.get(base_url, None)
+        if consumer is not None:
+            return consumer
+
+        response = self.http.get(base_url + '/plugins/servlet/oauth/consumer-info')
+        response.raise_for_status()
+        key = _CONSUMER_KEY.search(response.text)
+        public_key = _CONSUMER_PUBLIC_KEY.search(response.text)
+        if key is None or public_key is None:
+            raise Exception("Invalid Credentials")
+
+        consumer = (key.group(1), public_key.group(1))
+        self.cache.set(
+            base_url, consumer, ttl=_cache_control_ttl(response.headers, self.ttl))
+        return consumer
+
+    def invalidate(self, base_url):
+        """Forget what an instance reported"""
+        self.cache.invalidate(base_url.rstrip('/'))
+
+
+class FileCache(object):
+    """
+    Cache kept as files in a local directory, so processes on one host
+    share it. Values are pickled: only point it at a directory nobody else
+    can write to.
+
+    Has the same get/set/invalidate interface as :py:class:`ClientCache`.
+
+    :param path: directory holding the entries, created if missing
+    :param maxsize: entries kept, the least recently used ones are removed
+    :param ttl: default seconds an entry is kept
+    """
+    def __init__(self, path, maxsize=1024, ttl=300, timer=time.time):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def __len__(self):
+        return len(os.listdir(self.path))
+
+    def get(self, key, default=_MISSING):
+        filename = self._file(key)
+        try:
+            with open(filename, 'rb') as entry:
+                expires, value = pickle.load(entry)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return default
+        if expires <= self.timer():
+            self.invalidate(key)
+            return default
+        try:
+            # The modification time orders entries for eviction
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        handle, temporary = tempfile.mkstemp(dir=self.path, prefix='.')
+        with os.fdopen(handle, 'wb') as entry:
+            pickle.dump((self.timer() + ttl, value), entry, pickle.HIGHEST_PROTOCOL)
+        os.rename(temporary, self._file(key))
+        self._evict()
+
+    def _evict(self):
+        names = [name for name in os.listdir(self.path) if not name.startswith('.')]
+        if len(names) <= self.maxsize:
+            return
+        entries = []
+        for name in names:
+            try:
+                entries.append((os.path.getmtime(os.path.join(self.path, name)), name))
+            except OSError:
+                pass
+        for _, name in sorted(entries)[:len(entries) - self.maxsize]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+
+class ResponseCache(object):
+    """
+    Rendered module and webpanel responses, by client, handler and query
+    parameters (the jwt parameter aside)
+
+    Entries are tagged with a generation per client and handler, so
+    invalidating only has to forget the generation.
+
+    :param backend: where entries are kept, a :py:class:`ClientCache`
+        by default or a :py:class:`FileCache`
+    :param ttl: default seconds a response is kept
+    :param generation_ttl: seconds a generation is kept, responses are
+        dropped along with it
+    """
+    def __init__(self, backend=None, ttl=60, generation_ttl=86400):
+        if backend is None:
+            backend = ClientCache(maxsize=1024, ttl=ttl)
+        self.backend = backend
+        self.ttl = ttl
+        self.generation_ttl = generation_ttl
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _generation_key(client_key, handler):
+        return json.dumps(['generation', client_key, handler])
+
+    def _count(self, handler, hit):
+        with self._lock:
+            counters = self._counters.setdefault(handler, [0, 0])
+            counters[0 if hit else 1] += 1
+
+    def lookup(self, client_key, handler, query_params):
+        """
+        Find a cached response
+
+        :returns: the generation to store a freshly rendered response with,
+            and the cached response or `_MISSING`
+        :rtype: tuple"""
+        generation_key = self._generation_key(client_key, handler)
+        generation = self.backend.get(generation_key, None)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            self.backend.set(generation_key, generation, self.generation_ttl)
+            response = _MISSING
+        else:
+            response = self.backend.get(
+                self._key(client_key, handler, generation, query_params), _MISSING)
+        self._count(handler, response is not _MISSING)
+        return generation, response
+
+    def store(self, client_key, handler, query_params, generation, response, ttl=None):
+        """Cache a response rendered after :py:meth:`lookup` returned `generation`"""
+        if ttl is None:
+            ttl = self.ttl
+        generation_key = self._generation_key(client_key, handler)
+        if self.backend.get(generation_key, None) != generation:
+            # Invalidated while rendering
+            return
+        self.backend.set(
+            self._key(client_key, handler, generation, query_params), response, ttl)
+
+    @staticmethod
+    def _key(client_key, handler, generation, query_params):
+        params = []
+        for name in sorted(query_params or {}):
+            if name == 'jwt':
+                continue
+            if hasattr(query_params, 'getlist'):
+                params.append([name, query_params.getlist(name)])
+            else:
+                params.append([name, [query_params[name]]])
+        return json.dumps([client_key, handler, generation, params])
+
+    def invalidate(self, client_key, handler):
+        """Forget a client's responses from one handler"""
+        self.backend.invalidate(self._generation_key(client_key, handler))
+
+    def stats(self):
+        """
+        Hits, misses and hit ratio by handler
+
+        :rtype: dict"""
+        with self._lock:
+            counters = dict((k, list(v)) for k, v in self._counters.items())
+        return dict(
+            (handler, {'hits': hits, 'misses': misses,
+                       'hit_ratio': float(hits) / (hits + misses)})
+            for handler, (hits, misses) in counters.items())
@@ -1,11 +1,181 @@
 """Contains a default Client object if nothing else is provided"""
-import boto3
+import random
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    # python2
+    from Queue import Empty, Full, Queue
+except ImportError:
+    # python3
+    from queue import Empty, Full, Queue
+
+_RECORD_FIELDS = ('clientKey', 'sharedSecret', 'baseUrl', 'publicKey')
+
+# DynamoDB refuses BatchGetItem calls with more keys than this
+_BATCH_GET_SIZE = 100
+_BATCH_GET_ATTEMPTS = 5
+_BATCH_GET_BACKOFF = 0.05
+
+# Only what is needed to build a ClientRecord is read when scanning
+_SCAN_PROJECTION = 'clientKey, sharedSecret, baseUrl, #version'
+_SCAN_NAMES = {'#version': 'version'}
+_SCAN_DONE = object()
+
+_DEFAULT_TABLE_NAME = 'SP-Atlassian-Plugin-DB-ClientsTable-8WIBWGIOC8GR'
+
+# DynamoDB resources by settings, shared by every store in the process
+_resources = {}
+_resources_lock = threading.Lock()
+
+
+def _dynamodb_resource(region_name=None, endpoint_url=None, max_pool_connections=25,
+                       retry_mode='adaptive', max_attempts=3, connect_timeout=2,
+                       read_timeout=5):
+    """
+    DynamoDB resource for the given settings, built on first use and then
+    shared, so connections are pooled across stores and kept alive between
+    Lambda invocations."""
+    key = (region_name, endpoint_url, max_pool_connections, retry_mode,
+           max_attempts, connect_timeout, read_timeout)
+    resource = _resources.get(key)
+    if resource is not None:
+        return resource
+    with _resources_lock:
+        resource = _resources.get(key)
+        if resource is None:
+            try:
+                import boto3
+                from botocore.config import Config
+            except ImportError:
+                raise ImportError(
+                    'DynamoDBAtlassianConnectClient needs boto3, install '
+                    'Chalice-AtlassianConnect[dynamodb]')
+            options = dict(
+                max_pool_connections=max_pool_connections,
+                retries={'mode': retry_mode, 'max_attempts': max_attempts},
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout)
+            try:
+                config = Config(tcp_keepalive=True, **options)
+            except TypeError:
+                # botocore < 1.27 has no tcp_keepalive option
+                config = Config(**options)
+            resource = boto3.session.Session().resource(
+                'dynamodb', region_name=region_name,
+                endpoint_url=endpoint_url, config=config)
+            _resources[key] = resource
+    return resource
+
+
+class VersionConflict(Exception):
+    """
+    Raised by a store's save_if when the stored client is not at the
+    expected version, because another request changed it first"""
+
+
+class ClientRecord(object):
+    """
+    Immutable installation details for one Confluence/Jira/Etc instance
+
+    Anything else sent in the installed lifecycle payload is kept and
+    readable as an attribute as well.
+
+    :ivar clientKey: Confluence/Jira/Etc Unique Identifier
+    :ivar sharedSecret: Shared secret between instance and addon
+    :ivar baseUrl: Url for Confluence/Jira/Etc
+    :ivar publicKey: Public key of the instance
+
+    Records read from a store supporting conditional writes also have a
+    ``version``, bumped by each :py:meth:`AtlassianConnectClient.save_if`.
+    """
+    __slots__ = _RECORD_FIELDS + ('_extra',)
+
+    def __init__(self, clientKey=None, sharedSecret=None, baseUrl=None,
+                 publicKey=None, **kwargs):
+        setter = super(ClientRecord, self).__setattr__
+        setter('clientKey', clientKey)
+        setter('sharedSecret', sharedSecret)
+        setter('baseUrl', baseUrl)
+        setter('publicKey', publicKey)
+        setter('_extra', kwargs)
+
+    @classmethod
+    def from_client(cls, client):
+        """
+        Build a record out of a record, dict or client like object
+
+        :rtype: ClientRecord"""
+        if client is None or isinstance(client, cls):
+            return client
+        if isinstance(client, dict):
+            return cls(**client)
+        return cls(**dict(
+            (k, v) for k, v in vars(client).items() if not k.startswith('_')))
+
+    def __getattr__(self, name):
+        if name == '_extra':
+            raise AttributeError(name)
+        try:
+            return self._extra[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ClientRecord is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("ClientRecord is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, ClientRecord) and dict(self) == dict(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<ClientRecord clientKey=%r baseUrl=%r>' % (self.clientKey, self.baseUrl)
+
+    def __getstate__(self):
+        return dict(self)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def keys(self):
+        """Field names, so dict(record) works"""
+        keys = [k for k in _RECORD_FIELDS if getattr(self, k) is not None]
+        return keys + list(self._extra)
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def replace(self, **changes):
+        """
+        Copy of this record with some fields changed
+
+        :rtype: ClientRecord"""
+        fields = dict(self)
+        fields.update(changes)
+        return ClientRecord(**fields)
 
 
 class AtlassianConnectClient(object):
     """
     Reference implementation of Client object
 
+    Holds clients in memory. The store itself never changes when a client
+    is loaded, so one instance can be shared between threads.
+
+    Stores may also have a ``save_if(client, expected_version)`` method,
+    which the installed lifecycle uses to save without reading first.
+
     :ivar clientKey: Confluence/Jira/Etc Unique Identifier
     :ivar sharedSecret: Shared secret between instance and addon
     :ivar baseUrl: Url for Confluence/Jira/Etc
@@ -14,6 +184,7 @@ class AtlassianConnectClient(object):
         if state is None:
             state = {}
         self._state = state
+        self._lock = threading.Lock()
         self.clientKey = None
         self.sharedSecret = None
         self.baseUrl = None
@@ -27,15 +198,18 @@ class AtlassianConnectClient(object):
         :param client_key:
             jira/confluence clientKey to load from db
         :type app: string"""
-        del self._state[client_key]
+        self._state.pop(client_key, None)
 
-    def all(self):
+    def all(self, total_segments=1):
         """
-        Returns a list of all clients stored in the database
+        Iterates over all clients stored in the database
 
-        :returns: list of all clients
-        :rtype: list"""
-        return self._state
+        :param total_segments: accepted for compatibility with
+            :py:meth:`DynamoDBAtlassianConnectClient.all`, ignored
+        :returns: all clients
+        :rtype: iterator"""
+        for client in list(self._state.values()):
+            yield client
 
     def load(self, client_key):
         """
@@ -44,50 +218,474 @@ class AtlassianConnectClient(object):
         :param client_key:
             jira/confluence clientKey to load from db
         :type app: string
-        :rtype: Client or None"""
+        :rtype: ClientRecord or None"""
         return self._state.get(client_key)
 
+    def load_many(self, client_keys):
+        """
+        Loads several Clients from the (internal) database
+
+        :param client_keys:
+            jira/confluence clientKeys to load from db
+        :type client_keys: iterable
+        :returns: loaded clients by clientKey, unknown keys are left out
+        :rtype: dict"""
+        return dict(
+            (k, self._state[k]) for k in client_keys if k in self._state)
+
     def save(self, client):
         """
         Save a client to the database
 
         :param client:
-            Client object (Default Class or overriden class) to save
+            Client object (ClientRecord, dict or overriden class) to save
         :type app: Client"""
+        client = ClientRecord.from_client(client)
         self._state[client.clientKey] = client
 
+    def save_if(self, client, expected_version=None):
+        """
+        Save a client only if the stored one is still at the expected
+        version, by compare-and-swap
+
+        :param client:
+            Client object (ClientRecord, dict or overriden class) to save
+        :param expected_version: version of the stored client, None if
+            there should be none and 0 for one saved without a version
+        :raises VersionConflict: if the stored client is at another version
+        :returns: the saved client, with its new version
+        :rtype: ClientRecord"""
+        client = ClientRecord.from_client(client)
+        with self._lock:
+            stored = self._state.get(client.clientKey)
+            version = None if stored is None else getattr(stored, 'version', 0)
+            if version != expected_version:
+                raise VersionConflict(client.clientKey)
+            client = client.replace(version=(expected_version or 0) + 1)
+            self._state[client.clientKey] = client
+        return client
+
 
 class DynamoDBAtlassianConnectClient(object):
-    def __init__(self, table=None, **kwargs):
-        if table is None:
-            table = boto3.resource('dynamodb').Table('SP-Atlassian-Plugin-DB-ClientsTable-8WIBWGIOC8GR')
+    """
+    Client store backed by a DynamoDB table
+
+    Loading returns a new :py:class:`ClientRecord`, the store keeps no
+    per client state so one instance can serve concurrent requests.
+
+    Unless a table is given, the table resource is built on first use from
+    a DynamoDB resource shared by every store with the same settings.
+    boto3 is needed for this, install it with the ``dynamodb`` extra:
+    ``pip install Chalice-AtlassianConnect[dynamodb]``
+
+    :param table: boto3 Table resource to use instead
+    :param table_name: name of the clients table
+    :param region_name: AWS region, the environment's if not given
+    :param endpoint_url: DynamoDB endpoint, to use a local DynamoDB
+    :param max_pool_connections: connections kept alive by the resource
+    :param retry_mode: botocore retry mode, ``adaptive`` also rate limits
+        the client when DynamoDB throttles
+    :param max_attempts: attempts per call, including the first one
+    :param connect_timeout: seconds to wait for a connection
+    :param read_timeout: seconds to wait for a response
+    :param cipher: :py:class:`~chalice_atlassian_connect.encryption.SecretCipher`
+        shared secrets are encrypted with before they are stored
+    """
+    def __init__(self, table=None, table_name=_DEFAULT_TABLE_NAME, region_name=None,
+                 endpoint_url=None, max_pool_connections=25, retry_mode='adaptive',
+                 max_attempts=3, connect_timeout=2, read_timeout=5, cipher=None, **kwargs):
         self._table = table
+        self.cipher = cipher
+        self._table_name = table_name
+        self._resource_options = dict(
+            region_name=region_name,
+            endpoint_url=endpoint_url,
+            max_pool_connections=max_pool_connections,
+            retry_mode=retry_mode,
+            max_attempts=max_attempts,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout)
+        self._sleep = time.sleep
         self.clientKey = None
         self.sharedSecret = None
         self.baseUrl = None
         for k, v in list(kwargs.items()):
             setattr(self, k, v)
 
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build from DYNAMODB_TABLE, DYNAMODB_REGION, DYNAMODB_ENDPOINT_URL,
+        DYNAMODB_POOL_SIZE, DYNAMODB_RETRY_MODE, DYNAMODB_MAX_ATTEMPTS,
+        DYNAMODB_CONNECT_TIMEOUT and DYNAMODB_READ_TIMEOUT config values.
+        Secrets are encrypted with the SECRETS_KMS_KEY_ID KMS key, or the
+        key in the SECRETS_KEY_FILE file, if either is set.
+
+        :rtype: DynamoDBAtlassianConnectClient"""
+        cipher = None
+        if config.get('SECRETS_KMS_KEY_ID') or config.get('SECRETS_KEY_FILE'):
+            from .encryption import KMSKeyProvider, LocalKeyProvider, SecretCipher
+            if config.get('SECRETS_KMS_KEY_ID'):
+                provider = KMSKeyProvider(config['SECRETS_KMS_KEY_ID'])
+            else:
+                provider = LocalKeyProvider(config['SECRETS_KEY_FILE'])
+            cipher = SecretCipher(provider)
+        return cls(
+            cipher=cipher,
+            table_name=config.get('DYNAMODB_TABLE', _DEFAULT_TABLE_NAME),
+            region_name=config.get('DYNAMODB_REGION'),
+            endpoint_url=config.get('DYNAMODB_ENDPOINT_URL'),
+            max_pool_connections=config.get('DYNAMODB_POOL_SIZE', 25),
+            retry_mode=config.get('DYNAMODB_RETRY_MODE', 'adaptive'),
+            max_attempts=config.get('DYNAMODB_MAX_ATTEMPTS', 3),
+            connect_timeout=config.get('DYNAMODB_CONNECT_TIMEOUT', 2),
+            read_timeout=config.get('DYNAMODB_READ_TIMEOUT', 5))
+
+    @property
+    def table(self):
+        """
+        The clients table, built on first access
+
+        :rtype: boto3 Table resource"""
+        if self._table is None:
+            self._table = _dynamodb_resource(
+                **self._resource_options).Table(self._table_name)
+        return self._table
+
     def delete(self, client_key):
-        self._table.delete_item(Key={'clientKey': client_key})
+        self.table.delete_item(Key={'clientKey': client_key})
+
+    def all(self, total_segments=1):
+        """
+        Iterates over all clients, following LastEvaluatedKey so nothing is
+        truncated at the 1MB scan limit.
+
+        With more than one segment, a parallel scan is run on a thread pool
+        and pages are yielded as they arrive.
 
-    def all(self):
-        response = self._table.scan()
-        return response.get('Items')
+        :param total_segments: number of parallel scan segments
+        :returns: all clients
+        :rtype: iterator"""
+        if total_segments <= 1:
+            for page in self._scan_pages():
+                for item in page:
+                    yield self._record(item)
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        pages = Queue(maxsize=total_segments * 2)
+        stop = threading.Event()
+
+        def put(value):
+            while not stop.is_set():
+                try:
+                    pages.put(value, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def scan_segment(segment):
+            try:
+                for page in self._scan_pages(
+                        Segment=segment, TotalSegments=total_segments):
+                    if not put(page):
+                        return
+            except Exception as e:  # pylint: disable=broad-except
+                put(e)
+            finally:
+                put(_SCAN_DONE)
+
+        executor = ThreadPoolExecutor(max_workers=total_segments)
+        try:
+            for segment in range(total_segments):
+                executor.submit(scan_segment, segment)
+            running = total_segments
+            while running:
+                try:
+                    page = pages.get(timeout=0.1)
+                except Empty:
+                    continue
+                if page is _SCAN_DONE:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    for item in page:
+                        yield self._record(item)
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
+
+    def _scan_pages(self, **kwargs):
+        kwargs['ProjectionExpression'] = _SCAN_PROJECTION
+        kwargs['ExpressionAttributeNames'] = _SCAN_NAMES
+        while True:
+            response = self.table.scan(**kwargs)
+            yield response.get('Items', [])
+            if not response.get('LastEvaluatedKey'):
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
     def load(self, client_key):
-        response = self._table.get_item(Key={'clientKey': client_key}).get('Item')
+        response = self.table.get_item(Key={'clientKey': client_key}).get('Item')
         if response:
-            self.clientKey = response['clientKey']
-            self.sharedSecret = response['sharedSecret']
-            self.baseUrl = response['baseUrl']
-            return self
+            return self._record(response)
+
+    def load_many(self, client_keys):
+        """
+        Loads several clients using BatchGetItem, 100 keys per call.
+        The table resource's client takes care of (de)serializing items.
+        Unprocessed keys are retried with jittered exponential backoff.
+
+        :param client_keys:
+            jira/confluence clientKeys to load from db
+        :type client_keys: iterable
+        :returns: loaded clients by clientKey, unknown keys are left out
+        :rtype: dict"""
+        keys = list(OrderedDict.fromkeys(client_keys))
+        table_name = self.table.name
+        clients = {}
+        for start in range(0, len(keys), _BATCH_GET_SIZE):
+            request = {table_name: {'Keys': [
+                {'clientKey': key} for key in keys[start:start + _BATCH_GET_SIZE]]}}
+            attempt = 0
+            while request:
+                response = self.table.meta.client.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(table_name, []):
+                    record = self._record(item)
+                    clients[record.clientKey] = record
+                request = response.get('UnprocessedKeys')
+                if request:
+                    attempt += 1
+                    if attempt >= _BATCH_GET_ATTEMPTS:
+                        raise Exception(
+                            'Unable to load clients after %d attempts' % attempt)
+                    self._sleep(random.uniform(0, _BATCH_GET_BACKOFF * 2 ** attempt))
+        return clients
+
+    def _record(self, item):
+        shared_secret = item['sharedSecret']
+        if self.cipher is not None:
+            shared_secret = self.cipher.decrypt(shared_secret, item['clientKey'])
+        if 'version' in item:
+            return ClientRecord(
+                clientKey=item['clientKey'],
+                sharedSecret=shared_secret,
+                baseUrl=item['baseUrl'],
+                version=int(item['version']))
+        return ClientRecord(
+            clientKey=item['clientKey'],
+            sharedSecret=shared_secret,
+            baseUrl=item['baseUrl'])
+
+    def _stored_secret(self, client):
+        if self.cipher is None:
+            return client.sharedSecret
+        # Bound to the client key, it won't decrypt in another client's item
+        return self.cipher.encrypt(client.sharedSecret, client.clientKey)
 
     def save(self, client):
-        self._table.put_item(
+        client = ClientRecord.from_client(client)
+        self.table.put_item(
             Item={
                 'clientKey': client.clientKey,
-                'sharedSecret': client.sharedSecret,
+                'sharedSecret': self._stored_secret(client),
                 'baseUrl': client.baseUrl,
             }
         )
+
+    def save_if(self, client, expected_version=None):
+        """
+        Save a client with a single conditional PutItem, only if the stored
+        one is still at the expected version
+
+        :param client:
+            Client object (ClientRecord, dict or overriden class) to save
+        :param expected_version: version of the stored client, None if
+            there should be none and 0 for one saved without a version
+        :raises VersionConflict: if the stored client is at another version
+        :returns: the saved client, with its new version
+        :rtype: ClientRecord"""
+        client = ClientRecord.from_client(client)
+        version = (expected_version or 0) + 1
+        if expected_version is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(clientKey)'}
+        elif expected_version == 0:
+            condition = {
+                'ConditionExpression':
+                    'attribute_exists(clientKey) AND attribute_not_exists(#version)',
+                'ExpressionAttributeNames': {'#version': 'version'}}
+        else:
+            condition = {
+                'ConditionExpression': '#version = :expected',
+                'ExpressionAttributeNames': {'#version': 'version'},
+                'ExpressionAttributeValues': {':expected': expected_version}}
+        try:
+            self.table.put_item(
+                Item={
+                    'clientKey': client.clientKey,
+                    'sharedSecret': self._stored_secret(client),
+                    'baseUrl': client.baseUrl,
+                    'version': version,
+                },
+                **condition)
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            raise VersionConflict(client.clientKey)
+        return client.replace(version=version)
+
+
+class SQLiteAtlassianConnectClient(object):
+    """
+    Client store in a SQLite database, for single node deployments and
+    local testing without AWS
+
+    Each thread gets its own connection, the database is in WAL mode so
+    readers don't wait on writers. Use :py:meth:`save_many` to write many
+    clients in one transaction.
+
+    :param path: database file, created if missing
+    :param timeout: seconds to wait for another connection's write lock
+    """
+    def __init__(self, path='clients.db', timeout=5, **kwargs):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS clients ('
+            'clientKey TEXT PRIMARY KEY, '
+            'sharedSecret TEXT, '
+            'baseUrl TEXT, '
+            'version INTEGER)')
+        self.clientKey = None
+        self.sharedSecret = None
+        self.baseUrl = None
+        for k, v in list(kwargs.items()):
+            setattr(self, k, v)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build from the SQLITE_PATH config value
+
+        :rtype: SQLiteAtlassianConnectClient"""
+        return cls(path=config.get('SQLITE_PATH', 'clients.db'))
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            import sqlite3
+            # Transactions are started explicitly, see save_many and save_if
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+            # WAL keeps the database consistent without a sync per commit
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _record(row):
+        if row[3] is None:
+            return ClientRecord(clientKey=row[0], sharedSecret=row[1], baseUrl=row[2])
+        return ClientRecord(
+            clientKey=row[0], sharedSecret=row[1], baseUrl=row[2], version=row[3])
+
+    def delete(self, client_key):
+        self._connection().execute('DELETE FROM clients WHERE clientKey = ?', (client_key,))
+
+    def all(self, total_segments=1):
+        """
+        Iterates over all clients, fetching them in batches
+
+        :param total_segments: accepted for compatibility with
+            :py:meth:`DynamoDBAtlassianConnectClient.all`, ignored
+        :returns: all clients
+        :rtype: iterator"""
+        cursor = self._connection().execute(
+            'SELECT clientKey, sharedSecret, baseUrl, version FROM clients')
+        while True:
+            rows = cursor.fetchmany(_BATCH_GET_SIZE)
+            if not rows:
+                return
+            for row in rows:
+                yield self._record(row)
+
+    def load(self, client_key):
+        row = self._connection().execute(
+            'SELECT clientKey, sharedSecret, baseUrl, version FROM clients '
+            'WHERE clientKey = ?', (client_key,)).fetchone()
+        if row:
+            return self._record(row)
+
+    def load_many(self, client_keys):
+        """
+        Loads several clients, 100 keys per query
+
+        :param client_keys:
+            jira/confluence clientKeys to load from db
+        :type client_keys: iterable
+        :returns: loaded clients by clientKey, unknown keys are left out
+        :rtype: dict"""
+        keys = list(OrderedDict.fromkeys(client_keys))
+        connection = self._connection()
+        clients = {}
+        for start in range(0, len(keys), _BATCH_GET_SIZE):
+            chunk = keys[start:start + _BATCH_GET_SIZE]
+            rows = connection.execute(
+                'SELECT clientKey, sharedSecret, baseUrl, version FROM clients '
+                'WHERE clientKey IN (%s)' % ','.join('?' * len(chunk)), chunk)
+            for row in rows:
+                clients[row[0]] = self._record(row)
+        return clients
+
+    def save(self, client):
+        self.save_many([client])
+
+    def save_many(self, clients):
+        """
+        Save several clients in a single transaction
+
+        :param clients: Client objects (ClientRecord, dict or overriden class)
+        :type clients: iterable"""
+        rows = []
+        for client in clients:
+            client = ClientRecord.from_client(client)
+            rows.append((client.clientKey, client.sharedSecret, client.baseUrl))
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                'INSERT OR REPLACE INTO clients (clientKey, sharedSecret, baseUrl, version) '
+                'VALUES (?, ?, ?, NULL)', rows)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def save_if(self, client, expected_version=None):
+        """
+        Save a client only if the stored one is still at the expected
+        version, see :py:meth:`AtlassianConnectClient.save_if`
+
+        :raises VersionConflict: if the stored client is at another version
+        :rtype: ClientRecord"""
+        client = ClientRecord.from_client(client)
+        version = (expected_version or 0) + 1
+        connection = self._connection()
+        if expected_version is None:
+            cursor = connection.execute(
+                'INSERT OR IGNORE INTO clients (clientKey, sharedSecret, baseUrl, version) '
+                'VALUES (?, ?, ?, ?)',
+                (client.clientKey, client.sharedSecret, client.baseUrl, version))
+        else:
+            cursor = connection.execute(
+                'UPDATE clients SET sharedSecret = ?, baseUrl = ?, version = ? '
+                'WHERE clientKey = ? AND IFNULL(version, 0) = ?',
+                (client.sharedSecret, client.baseUrl, version,
+                 client.clientKey, expected_version))
+        if cursor.rowcount != 1:
+            raise VersionConflict(client.clientKey)
+        return client.replace(version=version)
@@ -0,0 +1,205 @@
+"""Envelope encryption of the shared secrets a store keeps
+
+Each secret is encrypted with AES-GCM under a data key, and the data key
+is stored next to it wrapped by a key provider's master key. A provider
+has two methods:
+
+* generate_data_key(): (plaintext, wrapped) pair of a new 256 bit key
+* decrypt_data_key(wrapped): the plaintext of a wrapped key
+
+:py:class:`SecretCipher` caches unwrapped data keys and decrypted secrets,
+so once warm, authenticating a request doesn't call the provider.
+
+Encryption needs the cryptography package, install it with the
+``encryption`` extra: ``pip install Chalice-AtlassianConnect[encryption]``
+"""
+import base64
+import os
+import threading
+import time
+
+from .cache import ClientCache
+
+# Prefix of encrypted values, anything else is read as a plaintext secret
+_PREFIX = 'enc1:'
+_NONCE_SIZE = 12
+
+
+def _aesgcm(key):
+    try:
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise ImportError(
+            'Encrypting secrets needs cryptography, install '
+            'Chalice-AtlassianConnect[encryption]')
+    return AESGCM(key)
+
+
+def _associated_data(context):
+    return None if context is None else context.encode('utf-8')
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data.encode('ascii'))
+
+
+class LocalKeyProvider(object):
+    """
+    Master key kept in a local file, for tests and local development
+
+    :param path: file holding the 32 byte master key, created if missing
+    """
+    def __init__(self, path):
+        self.path = path
+        self._key = None
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        if self._key is None:
+            with self._lock:
+                if self._key is None:
+                    self._key = self._load_or_create()
+        return self._key
+
+    def _load_or_create(self):
+        try:
+            with open(self.path, 'rb') as key_file:
+                return key_file.read()
+        except IOError:
+            pass
+        key = os.urandom(32)
+        try:
+            # Only readable by its owner, and never overwrite a key made meanwhile
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except OSError:
+            with open(self.path, 'rb') as key_file:
+                return key_file.read()
+        with os.fdopen(fd, 'wb') as key_file:
+            key_file.write(key)
+        return key
+
+    def generate_data_key(self):
+        plaintext = os.urandom(32)
+        nonce = os.urandom(_NONCE_SIZE)
+        return plaintext, nonce + _aesgcm(self.key).encrypt(nonce, plaintext, None)
+
+    def decrypt_data_key(self, wrapped):
+        return _aesgcm(self.key).decrypt(wrapped[:_NONCE_SIZE], wrapped[_NONCE_SIZE:], None)
+
+
+class KMSKeyProvider(object):
+    """
+    Data keys generated and unwrapped by AWS KMS, or anything speaking its
+    API
+
+    :param key_id: id, ARN or alias of the KMS key
+    :param client: boto3 KMS client, one is built on first use if not given
+    """
+    def __init__(self, key_id, client=None):
+        self.key_id = key_id
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImportError(
+                    'KMSKeyProvider needs boto3, install Chalice-AtlassianConnect[dynamodb]')
+            self._client = boto3.client('kms')
+        return self._client
+
+    def generate_data_key(self):
+        response = self.client.generate_data_key(KeyId=self.key_id, KeySpec='AES_256')
+        return response['Plaintext'], response['CiphertextBlob']
+
+    def decrypt_data_key(self, wrapped):
+        return self.client.decrypt(KeyId=self.key_id, CiphertextBlob=wrapped)['Plaintext']
+
+
+class SecretCipher(object):
+    """
+    Encrypts and decrypts secrets under data keys from `provider`
+
+    One data key encrypts every secret for `data_key_ttl` seconds before a
+    new one is generated. Unwrapped data keys and decrypted secrets are
+    kept in memory for `cache_ttl` seconds.
+
+    A `context`, such as the client key a secret belongs to, is
+    authenticated with the secret: a value only decrypts with the context
+    it was encrypted with, so it can't be copied to another tenant's row.
+
+    Values that are not encrypted are returned as is by
+    :py:meth:`decrypt`, so stores can be migrated gradually.
+
+    :param provider: :py:class:`LocalKeyProvider`, :py:class:`KMSKeyProvider`
+        or anything with the same methods
+    :param data_key_ttl: seconds a data key is used to encrypt for
+    :param cache_ttl: seconds decrypted keys and secrets are kept for
+    :param maxsize: decrypted secrets kept
+    """
+    def __init__(self, provider, data_key_ttl=300, cache_ttl=900, maxsize=1024,
+                 timer=time.time):
+        self.provider = provider
+        self.data_key_ttl = data_key_ttl
+        self._timer = timer
+        self._data_key = None
+        self._lock = threading.Lock()
+        self._data_keys = ClientCache(maxsize=64, ttl=cache_ttl, timer=timer)
+        self._secrets = ClientCache(maxsize=maxsize, ttl=cache_ttl, timer=timer)
+
+    def _current_data_key(self):
+        now = self._timer()
+        with self._lock:
+            if self._data_key is None or self._data_key[0] <= now:
+                plaintext, wrapped = self.provider.generate_data_key()
+                self._data_key = (now + self.data_key_ttl, plaintext, _b64encode(wrapped))
+                # Secrets just encrypted are decrypted without the provider
+                self._data_keys.set(self._data_key[2], plaintext)
+            return self._data_key[1:]
+
+    def encrypt(self, secret, context=None):
+        """
+        Encrypt a secret
+
+        :param context: string the value will only decrypt with
+        :rtype: string"""
+        if secret is None:
+            return None
+        key, wrapped = self._current_data_key()
+        nonce = os.urandom(_NONCE_SIZE)
+        ciphertext = _aesgcm(key).encrypt(
+            nonce, secret.encode('utf-8'), _associated_data(context))
+        return _PREFIX + wrapped + ':' + _b64encode(nonce + ciphertext)
+
+    def decrypt(self, value, context=None):
+        """
+        Decrypt a value made by :py:meth:`encrypt`, from memory if it was
+        decrypted recently
+
+        :param context: the context the value was encrypted with
+        :raises InvalidTag: if the value was tampered with or encrypted
+            with another context
+        :rtype: string"""
+        if value is None or not value.startswith(_PREFIX):
+            return value
+        cache_key = (context, value)
+        secret = self._secrets.get(cache_key, None)
+        if secret is None:
+            wrapped, ciphertext = value[len(_PREFIX):].split(':', 1)
+            key = self._data_keys.get(wrapped, None)
+            if key is None:
+                key = self.provider.decrypt_data_key(_b64decode(wrapped))
+                self._data_keys.set(wrapped, key)
+            ciphertext = _b64decode(ciphertext)
+            secret = _aesgcm(key).decrypt(
+                ciphertext[:_NONCE_SIZE], ciphertext[_NONCE_SIZE:],
+                _associated_data(context)).decode('utf-8')
+            self._secrets.set(cache_key, secret)
+        return secret
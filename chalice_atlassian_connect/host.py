@@ -0,0 +1,78 @@
+"""Several add-ons served by one Chalice app"""
+from chalice import NotFoundError
+
+from .session import HttpClient
+
+
+class AddonHost(object):
+    """
+    Serves several add-ons, each with its own ADDON_KEY, descriptor and
+    client store, from one Chalice app so they share a Lambda's cold start.
+
+    A single ``/{addon}/{section}/{name}`` route dispatches every request
+    on the first path segment, each add-on's `root_url`. Add-ons built with
+    the host share its :py:class:`~chalice_atlassian_connect.session.HttpClient`
+    and, if `client_cache` is given, one
+    :py:class:`~chalice_atlassian_connect.cache.ClientCache` in which each
+    add-on's clients are kept apart by its ADDON_KEY.
+
+    Example::
+
+        host = AddonHost(app, client_cache=ClientCache(maxsize=2048))
+        jira = AtlassianConnect(host=host, root_url='/jira', config=JIRA_CONFIG)
+        confluence = AtlassianConnect(
+            host=host, root_url='/confluence', config=CONFLUENCE_CONFIG)
+
+    :param app: Chalice app
+    :param http: shared HttpClient, built from `config` if not provided
+    :param client_cache: ClientCache partitioned between the add-ons
+    :param config: HTTP_* settings of the shared HttpClient
+    """
+    def __init__(self, app, http=None, client_cache=None, config=None):
+        self.app = app
+        if http is None:
+            http = HttpClient.from_config(config or {})
+        self.http = http
+        self.client_cache = client_cache
+        self.addons = {}
+        if not hasattr(app, 'root_urls'):
+            app.root_urls = []
+        app.route('/{addon}/atlassian-connect.json', methods=['GET'])(self._hosted_descriptor)
+        app.route('/{addon}/{section}/{name}', methods=['GET', 'POST'])(self._hosted_router)
+        app.context_processor = self._atlassian_jwt_post_token
+
+    def add(self, addon, root_url):
+        """
+        Serve an add-on under root_url, done by
+        :py:class:`~chalice_atlassian_connect.AtlassianConnect` when built
+        with a host
+
+        :param root_url: a single path segment such as ``/jira``"""
+        prefix = root_url.strip('/')
+        if not prefix or '/' in prefix:
+            raise ValueError(
+                'Hosted add-ons need a root_url of one path segment, not %r' % root_url)
+        if prefix in self.addons:
+            raise ValueError('An add-on is already hosted under %r' % root_url)
+        self.addons[prefix] = addon
+        self.app.root_urls.append(root_url)
+
+    def _addon(self, prefix):
+        addon = self.addons.get(prefix)
+        if addon is None:
+            self.app.log.debug('No add-on hosted under /%s', prefix)
+            raise NotFoundError
+        self.app.current_request.ac_addon = addon
+        return addon
+
+    def _hosted_descriptor(self, addon):
+        return self._addon(addon)._get_descriptor()
+
+    def _hosted_router(self, addon, section, name):
+        return self._addon(addon)._handler_router(section, name)
+
+    def _atlassian_jwt_post_token(self):
+        addon = getattr(self.app.current_request, 'ac_addon', None)
+        if addon is None:
+            return dict()
+        return addon._atlassian_jwt_post_token()
@@ -0,0 +1,139 @@
+"""Per stage timings of the requests the add-on handles
+
+An :py:class:`Instrumentation` passed to
+:py:class:`~chalice_atlassian_connect.AtlassianConnect` times the stages of
+each module, webpanel, webhook and lifecycle request:
+
+* jwt: verifying the token, client loads excluded
+* load: loading the client from the store
+* handler: the decorated function, or fetching its cached response
+* serialize: encoding the response body
+* total: the whole request, as seen by the add-on
+
+Each request's :py:class:`RequestTiming` is handed to the sinks, callables
+such as :py:class:`EMFLogSink`. Without an instrumentation handlers are
+registered as is and nothing is timed.
+"""
+import json
+import sys
+import time
+
+try:
+    _clock = time.perf_counter
+except AttributeError:
+    # python2
+    _clock = time.time
+
+# Stages in the order they are reported in
+STAGES = ('jwt', 'load', 'handler', 'serialize', 'total')
+
+
+class RequestTiming(object):
+    """
+    Stage timings of one request, in seconds
+
+    :param section: modules, webPanels, webhooks, lifecycle...
+    :param handler: handler name within the section
+    """
+    __slots__ = ('section', 'handler', 'client_key', 'status_code', 'stages', '_clock')
+
+    def __init__(self, section, handler, clock=_clock):
+        self.section = section
+        self.handler = handler
+        self.client_key = None
+        self.status_code = None
+        self.stages = {}
+        self._clock = clock
+
+    def clock(self):
+        return self._clock()
+
+    def add(self, stage, seconds):
+        """Add time spent in a stage, which may be entered several times"""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def milliseconds(self):
+        """
+        Stage timings in milliseconds, in reporting order
+
+        :rtype: list of (stage, ms) pairs"""
+        ordered = [stage for stage in STAGES if stage in self.stages]
+        ordered.extend(sorted(set(self.stages) - set(STAGES)))
+        return [(stage, round(self.stages[stage] * 1000, 3)) for stage in ordered]
+
+    def server_timing(self):
+        """
+        Value of a Server-Timing header
+
+        :rtype: string"""
+        return ', '.join('%s;dur=%s' % pair for pair in self.milliseconds())
+
+
+class EMFLogSink(object):
+    """
+    Writes each request's timings as a CloudWatch embedded metric format
+    line, which CloudWatch Logs turns into metrics. Each stage is a metric
+    named after it with a ``ms_`` prefix, such as ``ms_jwt``, dimensioned
+    by section and handler. The tenant is logged as a property only.
+
+    :param namespace: CloudWatch namespace of the metrics
+    :param stream: file written to, stdout by default as Lambda expects
+    """
+    def __init__(self, namespace='AtlassianConnect', stream=None, timer=time.time):
+        self.namespace = namespace
+        self.stream = stream
+        self._timer = timer
+
+    def __call__(self, timing):
+        # Prefixed so the handler stage doesn't overwrite the handler dimension
+        milliseconds = [('ms_' + stage, value) for stage, value in timing.milliseconds()]
+        record = {
+            '_aws': {
+                'Timestamp': int(self._timer() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['section', 'handler']],
+                    'Metrics': [{'Name': stage, 'Unit': 'Milliseconds'}
+                                for stage, _ in milliseconds],
+                }],
+            },
+            'section': timing.section,
+            'handler': timing.handler,
+            'clientKey': timing.client_key,
+            'statusCode': timing.status_code,
+        }
+        record.update(milliseconds)
+        stream = self.stream or sys.stdout
+        stream.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+
+class Instrumentation(object):
+    """
+    Times requests and reports them to `sinks`
+
+    Example::
+
+        ac = AtlassianConnect(app, instrumentation=Instrumentation(
+            sinks=[EMFLogSink()], server_timing=True))
+
+    :param sinks: callables each request's
+        :py:class:`RequestTiming` is passed to
+    :param server_timing: add a Server-Timing header to responses, which
+        shows up in the browser's developer tools
+    """
+    def __init__(self, sinks=(), server_timing=False, clock=_clock):
+        self.sinks = list(sinks)
+        self.server_timing = server_timing
+        self._clock = clock
+
+    def start(self, section, handler):
+        """
+        Begin timing a request
+
+        :rtype: RequestTiming"""
+        return RequestTiming(section, handler, self._clock)
+
+    def emit(self, timing):
+        """Hand a finished request's timings to each sink"""
+        for sink in self.sinks:
+            sink(timing)
@@ -0,0 +1,271 @@
+"""Signed calls from the add-on to a client's Jira/Confluence REST API"""
+import random
+import time
+from email.utils import mktime_tz, parsedate_tz
+
+from .cache import ClientCache
+
+try:
+    # python2
+    from urllib import urlencode
+    from urlparse import urlsplit
+except ImportError:
+    # python3
+    from urllib.parse import urlencode, urlsplit
+
+# Tokens are not reused this close to their expiry
+_TOKEN_MARGIN = 30
+
+
+def _retry_after(response, timer):
+    """Seconds a 429 response asks to wait, None if it doesn't say"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, mktime_tz(date) - timer())
+
+
+class AtlassianRestClient(object):
+    """
+    REST client bound to one installed client, usually made with
+    :py:meth:`~chalice_atlassian_connect.AtlassianConnect.rest`
+
+    Requests are signed with a JWT issued by the add-on. The token for a
+    method, path and query is reused until shortly before it expires.
+    Connections come from the shared
+    :py:class:`~chalice_atlassian_connect.session.HttpClient`, which keeps
+    a pool of connections alive per host.
+
+    429 responses are retried after the Retry-After delay, or with jittered
+    exponential backoff when there is none.
+
+    Example::
+
+        issue = ac.rest(client).get('/rest/api/2/issue/TEST-1').json()
+
+    :param client: installed client, with clientKey, sharedSecret and baseUrl
+    :param addon_key: the add-on's key, used as the token's issuer
+    :param http: :py:class:`~chalice_atlassian_connect.session.HttpClient`
+    :param tokens: cache of signed tokens, shared between clients
+    :param token_ttl: seconds a token is valid for
+    :param max_retries: how many times a 429 response is retried
+    :param max_retry_after: longest Retry-After waited for, in seconds.
+        A 429 asking for a longer wait is returned as is.
+    :param backoff_factor: base of the backoff when there is no Retry-After
+    """
+    def __init__(self, client, addon_key, http, tokens=None, token_ttl=180,
+                 max_retries=3, max_retry_after=30, backoff_factor=0.5,
+                 timer=time.time):
+        self.client = client
+        self.addon_key = addon_key
+        self.http = http
+        if tokens is None:
+            tokens = ClientCache(maxsize=1024)
+        self.tokens = tokens
+        self.token_ttl = token_ttl
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.backoff_factor = backoff_factor
+        self._timer = timer
+        self._sleep = time.sleep
+
+    def _signed_path(self, path, params):
+        if not params:
+            return path
+        if hasattr(params, 'items'):
+            params = params.items()
+        query = urlencode(sorted(params), doseq=True)
+        return path + ('&' if '?' in path else '?') + query
+
+    def token(self, method, path):
+        """
+        JWT for a request, reused for identical requests while it is valid
+
+        :param method: HTTP method
+        :param path: path relative to the client's baseUrl, with any query
+        :rtype: string"""
+        method = method.upper()
+        cache_key = (self.client.clientKey, self.client.sharedSecret, method, path)
+        token = self.tokens.get(cache_key, None)
+        if token is None:
+            from atlassian_jwt import encode_token
+            token = encode_token(
+                method, path, self.addon_key, self.client.sharedSecret,
+                timeout_secs=self.token_ttl)
+            self.tokens.set(cache_key, token, self.token_ttl - _TOKEN_MARGIN)
+        return token
+
+    def request(self, method, path, params=None, **kwargs):
+        """
+        Make a signed request
+
+        :param method: HTTP method
+        :param path: path relative to the client's baseUrl
+        :param params: query parameters, as a dict or list of pairs
+        :rtype: :py:class:`requests.Response`"""
+        path = self._signed_path(path, params)
+        url = self.client.baseUrl.rstrip('/') + path
+        headers = dict(kwargs.pop('headers', None) or {})
+        attempt = 0
+        while True:
+            headers['Authorization'] = 'JWT ' + self.token(method, path)
+            response = self.http.request(method, url, headers=headers, **kwargs)
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            delay = _retry_after(response, self._timer)
+            if delay is None:
+                delay = random.uniform(0, self.backoff_factor * 2 ** attempt)
+            elif delay > self.max_retry_after:
+                return response
+            response.close()
+            attempt += 1
+            self._sleep(delay)
+
+    def _page(self, path, params):
+        response = self.get(path, params=params)
+        response.raise_for_status()
+        return response.json()
+
+    def _walk(self, path, params, items_key, next_request, prefetch):
+        """
+        Yields the items of each page, fetching the page after next while
+        the current one is consumed. At most two pages are held at once.
+        """
+        if not prefetch:
+            while path is not None:
+                page = self._page(path, params)
+                for item in page.get(items_key, []):
+                    yield item
+                path, params = next_request(page, path, params)
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        pending = None
+        try:
+            pending = executor.submit(self._page, path, params)
+            while pending is not None:
+                page = pending.result()
+                path, params = next_request(page, path, params)
+                pending = None
+                if path is not None:
+                    pending = executor.submit(self._page, path, params)
+                for item in page.get(items_key, []):
+                    yield item
+        finally:
+            # Stopping early waits for the prefetched page, never beyond it
+            if pending is not None:
+                pending.cancel()
+            executor.shutdown(wait=True)
+
+    def _first_params(self, params, fields, fields_param):
+        params = dict(params or {})
+        if fields:
+            params[fields_param] = ','.join(fields)
+        return params
+
+    def paginate(self, path, items_key='values', params=None, page_size=50,
+                 fields=None, fields_param='fields', start_param='startAt',
+                 limit_param='maxResults', prefetch=True):
+        """
+        Iterate over a collection paged with a start offset and page size,
+        such as Jira's search (``items_key='issues'``) or Confluence's
+        content (``items_key='results', start_param='start',
+        limit_param='limit'``).
+
+        Items are yielded as they arrive, the next page being fetched while
+        the current one is consumed. Stop iterating to stop fetching.
+
+        Example::
+
+            for issue in ac.rest(client).paginate(
+                    '/rest/api/2/search', items_key='issues',
+                    params={'jql': 'project = TEST'}, fields=['summary']):
+                ...
+
+        :param path: path relative to the client's baseUrl
+        :param items_key: key of the items in each page
+        :param params: other query parameters
+        :param page_size: items asked for per page
+        :param fields: names of the fields returned for each item
+        :param fields_param: query parameter fields are passed as
+        :param prefetch: fetch the next page in the background
+        :rtype: iterator of dicts"""
+        params = self._first_params(params, fields, fields_param)
+        params[limit_param] = page_size
+        params[start_param] = params.get(start_param, 0)
+
+        def next_request(page, path, params):
+            count = len(page.get(items_key, []))
+            start = params[start_param] + count
+            last = any((
+                not count,
+                page.get('isLast'),
+                start >= page.get('total', float('inf')),
+                # A short page is the last one when there is no total
+                count < page.get(limit_param, page_size)))
+            if last:
+                return None, None
+            return path, dict(params, **{start_param: start})
+
+        return self._walk(path, params, items_key, next_request, prefetch)
+
+    def paginate_cursor(self, path, items_key='values', params=None, page_size=50,
+                        fields=None, fields_param='fields', cursor_key='nextPageToken',
+                        cursor_param='nextPageToken', limit_param='maxResults',
+                        prefetch=True):
+        """
+        Iterate over a collection paged with a cursor, such as Jira's
+        ``/rest/api/3/search/jql`` (``items_key='issues'``). With
+        ``cursor_key=None`` the page's ``_links.next`` link is followed
+        instead, as Confluence's v2 API (``items_key='results',
+        limit_param='limit'``) expects.
+
+        Items are yielded lazily with the next page prefetched, as with
+        :py:meth:`paginate`.
+
+        :param cursor_key: key of the next page's cursor in each page
+        :param cursor_param: query parameter the cursor is passed as
+        :rtype: iterator of dicts"""
+        params = self._first_params(params, fields, fields_param)
+        params[limit_param] = page_size
+        base_path = urlsplit(self.client.baseUrl).path.rstrip('/')
+
+        def next_request(page, path, params):
+            if cursor_key is None:
+                link = page.get('_links', {}).get('next')
+                if not link:
+                    return None, None
+                # Links include the site's context path, /wiki on Confluence
+                if base_path and link.startswith(base_path + '/'):
+                    link = link[len(base_path):]
+                return link, None
+            cursor = page.get(cursor_key)
+            if not cursor or page.get('isLast'):
+                return None, None
+            return path, dict(params, **{cursor_param: cursor})
+
+        return self._walk(path, params, items_key, next_request, prefetch)
+
+    def get(self, path, params=None, **kwargs):
+        """Make a signed GET request"""
+        return self.request('GET', path, params=params, **kwargs)
+
+    def post(self, path, params=None, **kwargs):
+        """Make a signed POST request"""
+        return self.request('POST', path, params=params, **kwargs)
+
+    def put(self, path, params=None, **kwargs):
+        """Make a signed PUT request"""
+        return self.request('PUT', path, params=params, **kwargs)
+
+    def delete(self, path, params=None, **kwargs):
+        """Make a signed DELETE request"""
+        return self.request('DELETE', path, params=params, **kwargs)
@@ -0,0 +1,139 @@
+"""Shared HTTP session for calls made back to Atlassian products"""
+import random
+import threading
+
+_retry_class = None
+
+
+def _jittered_retry_class():
+    """
+    Retry with full jitter, so a burst of installs doesn't retry in lockstep
+
+    Built on first use so urllib3 is only imported once a request is made"""
+    global _retry_class  # pylint: disable=global-statement
+    if _retry_class is None:
+        try:
+            from urllib3.util.retry import Retry
+        except ImportError:
+            # requests < 2.16 vendors urllib3
+            from requests.packages.urllib3.util.retry import Retry
+
+        class _JitteredRetry(Retry):
+            def get_backoff_time(self):
+                backoff = super(_JitteredRetry, self).get_backoff_time()
+                return random.uniform(0, backoff)
+
+        _retry_class = _JitteredRetry
+    return _retry_class
+
+
+def _make_retry(retries, backoff_factor):
+    retry_class = _jittered_retry_class()
+    kwargs = dict(
+        total=retries,
+        # A host that is slow to answer isn't retried, so it can't hold
+        # the request for several read timeouts
+        read=False,
+        backoff_factor=backoff_factor,
+        status_forcelist=(500, 502, 503, 504))
+    # Retry-After is left to callers, a 429 asking to wait minutes would
+    # otherwise block the request for that long. urllib3 < 1.19 has no
+    # such option and urllib3 < 1.15 can't hand back the last failed
+    # response either.
+    for options in ({'raise_on_status': False, 'respect_retry_after_header': False},
+                    {'raise_on_status': False},
+                    {}):
+        try:
+            return retry_class(**dict(kwargs, **options))
+        except TypeError:
+            continue
+
+
+class HttpClient(object):
+    """
+    Keep-alive connection pool with timeouts and bounded retries
+
+    Example::
+
+        ac = AtlassianConnect(app, http=HttpClient(timeout=(1, 5), retries=2))
+
+    :param session: requests Session to use, one is built on first use if
+        not provided, so requests isn't imported until it is needed
+    :param timeout: (connect, read) timeout in seconds applied to every request
+    :param retries: how many times connection errors and 5xx responses
+        to idempotent requests are retried. Read timeouts are never retried,
+        so a slow host costs at most one read timeout.
+    :param backoff_factor: base of the exponential backoff between retries
+    :param pool_maxsize: connections kept alive per host
+    :param pool_hosts: hosts connections are kept alive for, the least
+        recently used host's pool is closed beyond that
+    """
+    def __init__(self, session=None, timeout=(3.05, 10), retries=3,
+                 backoff_factor=0.2, pool_maxsize=10, pool_hosts=None):
+        self._session = session
+        self._lock = threading.Lock()
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
+        self.pool_hosts = pool_hosts or pool_maxsize
+
+    @property
+    def session(self):
+        """
+        The pooled session, built on first access
+
+        :rtype: :py:class:`requests.Session`"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+
+        session = Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_hosts,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=_make_retry(self.retries, self.backoff_factor))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build from HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_RETRIES,
+        HTTP_POOL_SIZE and HTTP_POOL_HOSTS config values
+
+        :rtype: HttpClient"""
+        return cls(
+            timeout=(config.get('HTTP_CONNECT_TIMEOUT', 3.05),
+                     config.get('HTTP_READ_TIMEOUT', 10)),
+            retries=config.get('HTTP_RETRIES', 3),
+            pool_maxsize=config.get('HTTP_POOL_SIZE', 10),
+            pool_hosts=config.get('HTTP_POOL_HOSTS'))
+
+    def request(self, method, url, **kwargs):
+        """
+        Make a request, with the default timeout unless one is given
+
+        :rtype: :py:class:`requests.Response`"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """Make a GET request"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Make a POST request"""
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """Close pooled connections"""
+        if self._session is not None:
+            self._session.close()
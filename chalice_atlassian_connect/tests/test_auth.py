@@ -0,0 +1,186 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+import unittest
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, AtlassianConnectClient
+from atlassian_jwt.encode import encode_token
+from atlassian_jwt.url_utils import hash_url
+from jwt.exceptions import DecodeError, ExpiredSignatureError
+
+CONFIG = {
+    'ADDON_KEY': 'test-addon',
+    'ADDON_VENDOR_NAME': 'SinglePlatform',
+    'ADDON_VENDOR_URL': 'https://www.singleplatform.com',
+}
+
+
+def _signed_token(claims, secret):
+    """HS256 token with any claims, pyjwt refuses some of them"""
+    def encode(part):
+        return base64.urlsafe_b64encode(part).rstrip(b'=')
+    signing_input = b'.'.join(encode(json.dumps(part).encode('utf-8')) for part in (
+        {'alg': 'HS256', 'typ': 'JWT'}, claims))
+    signature = hmac.new(secret.encode('utf-8'), signing_input, hashlib.sha256).digest()
+    return (signing_input + b'.' + encode(signature)).decode('ascii')
+
+
+class _CountingClient(AtlassianConnectClient):
+    """In memory client that counts how often it hits the store"""
+    def __init__(self, *args, **kwargs):
+        super(_CountingClient, self).__init__(*args, **kwargs)
+        self.loads = 0
+
+    def load(self, client_key):
+        self.loads += 1
+        return super(_CountingClient, self).load(client_key)
+
+
+class AuthenticationTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(
+            self.app, client_class=_CountingClient, config=CONFIG)
+        self.ac.client_class.save(_CountingClient(
+            clientKey='test_auth',
+            sharedSecret='myscret',
+            baseUrl='https://gavindev.atlassian.net'))
+
+        @self.ac.module(key="configurePage")
+        def configure_page(client):
+            lookups = self.app.current_request.ac_store_lookups
+            return {'clientKey': client.clientKey, 'lookups': lookups}
+
+    def test_module_loads_client_once(self):
+        """An authenticated request should only load the client once"""
+        auth = encode_token(
+            'GET', '/modules/configurePage', 'test_auth', 'myscret')
+        with Client(self.app) as client:
+            response = client.http.get(
+                '/modules/configurePage',
+                headers={'Authorization': 'JWT ' + auth})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            {'clientKey': 'test_auth', 'lookups': 1}, response.json_body)
+        self.assertEqual(1, self.ac.client_class.loads)
+
+    def test_authenticate_client(self):
+        """authenticate_client hands back the client it verified with"""
+        auth = encode_token('GET', '/modules/configurePage', 'test_auth', 'myscret')
+        result = self.ac.auth.authenticate_client(
+            'GET', '/modules/configurePage', {'Authorization': 'JWT ' + auth})
+        self.assertEqual('test_auth', result.client_key)
+        self.assertEqual('test_auth', result.client.clientKey)
+        self.assertEqual(1, result.lookups)
+
+        # Outside of authenticate_client, nothing is memoized
+        self.ac.auth.load_client('test_auth')
+        self.ac.auth.load_client('test_auth')
+        self.assertEqual(3, self.ac.client_class.loads)
+
+
+class FastPathTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.ac = AtlassianConnect(
+            Chalice("app"), client_class=_CountingClient, config=CONFIG)
+        self.ac.client_class.save(_CountingClient(
+            clientKey='test_auth', sharedSecret='myscret'))
+        self.url = '/modules/configurePage?issueKey=TEST-1'
+
+    def _authenticate(self, auth, url=None):
+        return self.ac.auth.authenticate(
+            'GET', url or self.url, {'Authorization': 'JWT ' + auth})
+
+    def test_valid_token(self):
+        auth = encode_token('GET', self.url, 'test_auth', 'myscret')
+        for _ in range(2):
+            client_key, claims = self._authenticate(auth)
+            self.assertEqual('test_auth', client_key)
+            self.assertEqual('test_auth', claims['iss'])
+        self.assertEqual(1, len(self.ac.auth._hmac_keys))
+        self.assertEqual(1, len(self.ac.auth._url_hashes))
+
+    def test_malformed_tokens_skip_store(self):
+        for auth in ('garbage', 'a.b.c', 'a.b', '...'):
+            self.assertRaises(DecodeError, self._authenticate, auth)
+        auth = encode_token('GET', '/other', 'test_auth', 'myscret')
+        self.assertRaises(DecodeError, self._authenticate, auth)
+        # Well formed, but the issuer isn't a client key
+        for iss in (123, ['test_auth']):
+            auth = _signed_token({
+                'iss': iss, 'iat': int(time.time()), 'exp': int(time.time()) + 60,
+                'qsh': hash_url('GET', self.url)}, 'myscret')
+            self.assertRaises(DecodeError, self._authenticate, auth)
+            self.assertRaises(DecodeError, self.ac.auth.verify_token, auth, 'myscret')
+        self.assertEqual(0, self.ac.client_class.loads)
+
+    def test_bad_signature(self):
+        auth = encode_token('GET', self.url, 'test_auth', 'not the secret')
+        self.assertRaises(DecodeError, self._authenticate, auth)
+
+    def test_expired(self):
+        auth = encode_token(
+            'GET', self.url, 'test_auth', 'myscret',
+            payload_kwargs={'exp': int(time.time()) - 3600})
+        self.assertRaises(ExpiredSignatureError, self._authenticate, auth)
+
+    def test_rotated_secret(self):
+        self._authenticate(encode_token('GET', self.url, 'test_auth', 'myscret'))
+        self.ac.client_class.save(_CountingClient(
+            clientKey='test_auth', sharedSecret='rotated'))
+        auth = encode_token('GET', self.url, 'test_auth', 'myscret')
+        self.assertRaises(DecodeError, self._authenticate, auth)
+        self._authenticate(encode_token('GET', self.url, 'test_auth', 'rotated'))
+
+    def test_verify_token(self):
+        auth = encode_token('POST', '/lifecycle/installed', 'test_auth', 'myscret')
+        self.assertEqual(
+            'test_auth', self.ac.auth.verify_token(auth, 'myscret')['iss'])
+        self.assertRaises(DecodeError, self.ac.auth.verify_token, auth, 'other')
+
+
+class PostUrlTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(self.app, config=CONFIG)
+        self.ac.client_class.save(AtlassianConnectClient(
+            clientKey='test_auth', sharedSecret='myscret'))
+
+        @self.ac.module(key="configurePage")
+        def configure_page(client):
+            return {'url': self.ac.post_url(),
+                    'context': self.ac._atlassian_jwt_post_token()}
+
+    def _get(self, query):
+        auth = encode_token('GET', '/modules/configurePage', 'test_auth', 'myscret')
+        with Client(self.app) as client:
+            return client.http.get(
+                '/modules/configurePage' + query,
+                headers={'Authorization': 'JWT ' + auth}).json_body
+
+    def test_signed_and_reused(self):
+        body = self._get('?b=2&a=1&a=0&jwt=old')
+        url = body['url']
+        self.assertEqual({'atlassian_jwt_post_url': url}, body['context'])
+        self.assertTrue(url.startswith('/modules/configurePage?a=1&a=0&b=2&jwt='))
+        token = url.rsplit('jwt=', 1)[1]
+        claims = self.ac.auth.verify_token(token, 'myscret')
+        self.assertEqual('test_auth', claims['iss'])
+        self.assertEqual(
+            hash_url('POST', '/modules/configurePage?a=1&a=0&b=2'), claims['qsh'])
+        self.assertEqual(url, self._get('?a=1&a=0&b=2')['url'])
+        self.assertNotEqual(url, self._get('?a=1')['url'])
+
+    def test_no_query(self):
+        url = self._get('')['url']
+        self.assertTrue(url.startswith('/modules/configurePage?jwt='))
+
+
+if __name__ == '__main__':
+    unittest.main()
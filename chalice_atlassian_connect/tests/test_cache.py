@@ -0,0 +1,200 @@
+import shutil
+import tempfile
+import unittest
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, AtlassianConnectClient, ClientCache, ClientRecord, ResponseCache
+from ..cache import CachedClient, FileCache
+from .test_auth import CONFIG, _CountingClient
+from atlassian_jwt.encode import encode_token
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ClientCacheTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.clock = _Clock()
+        self.cache = ClientCache(maxsize=2, ttl=60, negative_ttl=5, timer=self.clock)
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.assertEqual(1, self.cache.get('a'))
+        self.cache.set('c', 3)
+        self.assertIsNone(self.cache.get('b', None))
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(3, self.cache.get('c'))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_ttl(self):
+        self.cache.set('a', 1)
+        self.cache.set('unknown', None)
+        self.clock.now += 10
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual('gone', self.cache.get('unknown', 'gone'))
+        self.clock.now += 60
+        self.assertEqual('gone', self.cache.get('a', 'gone'))
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+        self.assertEqual(2, stats['expirations'])
+        self.assertEqual(0, stats['size'])
+
+
+class CachedClientTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.store = _CountingClient()
+        self.client = CachedClient(self.store, ClientCache())
+        self.store.save(AtlassianConnectClient(clientKey='abc', sharedSecret='one'))
+
+    def test_load_is_cached(self):
+        self.assertEqual('one', self.client.load('abc').sharedSecret)
+        self.assertEqual('one', self.client.load('abc').sharedSecret)
+        self.assertEqual(1, self.store.loads)
+
+    def test_negative_caching(self):
+        self.assertIsNone(self.client.load('nope'))
+        self.assertIsNone(self.client.load('nope'))
+        self.assertEqual(1, self.store.loads)
+
+    def test_load_many(self):
+        self.store.save(AtlassianConnectClient(clientKey='def', sharedSecret='two'))
+        self.client.load('abc')
+        clients = self.client.load_many(['abc', 'def', 'nope'])
+        self.assertEqual(['abc', 'def'], sorted(clients))
+        self.assertEqual({}, self.client.load_many(['nope']))
+        self.assertEqual(1, self.store.loads)
+        self.assertEqual(2, self.client.cache.stats()['hits'])
+
+    def test_save_and_delete_invalidate(self):
+        self.client.load('abc')
+        self.client.save(AtlassianConnectClient(clientKey='abc', sharedSecret='two'))
+        self.assertEqual('two', self.client.load('abc').sharedSecret)
+        self.client.delete('abc')
+        self.assertIsNone(self.client.load('abc'))
+        self.assertEqual(3, self.store.loads)
+
+    def test_save_dict(self):
+        self.client.load('abc')
+        self.client.save({'clientKey': 'abc', 'sharedSecret': 'three'})
+        self.assertEqual('three', self.client.load('abc').sharedSecret)
+
+
+class CachedAddonTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_requests_share_cache(self):
+        app = Chalice("app")
+        cache = ClientCache()
+        ac = AtlassianConnect(
+            app, client_class=_CountingClient, config=CONFIG, client_cache=cache)
+        ac.client_class.save(AtlassianConnectClient(
+            clientKey='test_cache', sharedSecret='myscret'))
+        lookups = []
+        ac.module(key="configurePage")(
+            lambda client: lookups.append(app.current_request.ac_store_lookups))
+
+        auth = encode_token('GET', '/modules/configurePage', 'test_cache', 'myscret')
+        with Client(app) as client:
+            for _ in range(3):
+                response = client.http.get(
+                    '/modules/configurePage',
+                    headers={'Authorization': 'JWT ' + auth})
+                self.assertEqual(204, response.status_code)
+        self.assertEqual(1, ac.client_class.wrapped.loads)
+        self.assertEqual(2, cache.stats()['hits'])
+        self.assertEqual([1, 0, 0], lookups)
+
+
+class FileCacheTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = _Clock()
+        self.cache = FileCache(self.directory, maxsize=2, ttl=60, timer=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_ttl_and_invalidate(self):
+        self.cache.set('a', {'body': 1})
+        self.assertEqual({'body': 1}, FileCache(self.directory, timer=self.clock).get('a'))
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a', None))
+        self.cache.set('b', 2, ttl=5)
+        self.clock.now += 6
+        self.assertIsNone(self.cache.get('b', None))
+        self.assertEqual(0, len(self.cache))
+
+    def test_eviction(self):
+        for key in 'abc':
+            self.cache.set(key, key)
+            self.clock.now += 1
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual('c', self.cache.get('c'))
+
+
+class ResponseCacheTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(self.app, config=CONFIG)
+        self.ac.client_class.save(ClientRecord(clientKey='abc', sharedSecret='myscret'))
+        self.ac.client_class.save(ClientRecord(clientKey='def', sharedSecret='myscret'))
+        self.renders = []
+
+        @self.ac.webpanel(key='userPanel', query_params='issueKey={issue.key}', cache_ttl=60)
+        def user_panel(client):
+            issue_key = self.app.current_request.query_params['issueKey']
+            self.renders.append((client.clientKey, issue_key))
+            return 'issue %s for %s' % (issue_key, client.clientKey)
+
+    def _get(self, client_key, query):
+        path = '/webPanels/userPanel'
+        auth = encode_token('GET', path, client_key, 'myscret')
+        with Client(self.app) as client:
+            response = client.http.get(
+                '%s?%s' % (path, query), headers={'Authorization': 'JWT ' + auth})
+        self.assertEqual(200, response.status_code)
+        return response.body
+
+    def test_cached_per_client_and_params(self):
+        self.assertEqual(b'issue TEST-1 for abc', self._get('abc', 'issueKey=TEST-1'))
+        self.assertEqual(b'issue TEST-1 for abc', self._get('abc', 'issueKey=TEST-1'))
+        self._get('abc', 'issueKey=TEST-2')
+        self.assertEqual(b'issue TEST-1 for def', self._get('def', 'issueKey=TEST-1'))
+        self.assertEqual(
+            [('abc', 'TEST-1'), ('abc', 'TEST-2'), ('def', 'TEST-1')], self.renders)
+        stats = self.ac.response_cache.stats()['webPanels/userPanel']
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(0.25, stats['hit_ratio'])
+
+    def test_invalidate(self):
+        self._get('abc', 'issueKey=TEST-1')
+        self._get('def', 'issueKey=TEST-1')
+        self.ac.invalidate_responses('abc', 'userPanel')
+        self._get('abc', 'issueKey=TEST-1')
+        self._get('def', 'issueKey=TEST-1')
+        self.ac.invalidate_responses('def')
+        self._get('def', 'issueKey=TEST-1')
+        self.assertEqual(
+            [('abc', 'TEST-1'), ('def', 'TEST-1'), ('abc', 'TEST-1'), ('def', 'TEST-1')],
+            self.renders)
+
+    def test_invalidated_while_rendering(self):
+        cache = ResponseCache()
+        generation, response = cache.lookup('abc', 'modules/page', {'a': '1'})
+        cache.invalidate('abc', 'modules/page')
+        cache.store('abc', 'modules/page', {'a': '1'}, generation, 'stale')
+        self.assertIsNot('stale', cache.lookup('abc', 'modules/page', {'a': '1'})[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,487 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from invoke import Context
+import boto3
+import requests_mock
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from botocore.stub import Stubber
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, AtlassianConnectClient, ClientRecord, VersionConflict
+from ..cache import CachedClient, ClientCache
+from ..client import DynamoDBAtlassianConnectClient, SQLiteAtlassianConnectClient
+from .test_auth import CONFIG
+from atlassian_jwt.encode import encode_token
+
+consumer_info_response = """<?xml version="1.0" encoding="UTF-8"?>
+    <consumer>
+    <key>abc123</key>
+    <name>JIRA</name>
+    <publicKey>public123</publicKey>
+    <description>Atlassian JIRA at https://gavindev.atlassian.net </description>
+    </consumer>"""
+
+
+class ClientRecordTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_immutable(self):
+        record = ClientRecord(clientKey='abc', sharedSecret='secret', productType='jira')
+        self.assertEqual('jira', record.productType)
+        self.assertRaises(AttributeError, setattr, record, 'sharedSecret', 'other')
+        self.assertRaises(AttributeError, getattr, record, 'nope')
+
+    def test_dict_round_trip(self):
+        record = ClientRecord(clientKey='abc', sharedSecret='secret', productType='jira')
+        self.assertEqual(
+            {'clientKey': 'abc', 'sharedSecret': 'secret', 'productType': 'jira'},
+            dict(record))
+        self.assertEqual(record, ClientRecord(**dict(record)))
+        self.assertEqual(record, pickle.loads(pickle.dumps(record)))
+        self.assertEqual('new', record.replace(sharedSecret='new').sharedSecret)
+        self.assertEqual('secret', record.sharedSecret)
+
+    def test_from_client(self):
+        legacy = AtlassianConnectClient(clientKey='abc', sharedSecret='secret')
+        record = ClientRecord.from_client(legacy)
+        self.assertEqual('abc', record.clientKey)
+        self.assertIs(record, ClientRecord.from_client(record))
+
+
+class ClientStoreTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_concurrent_loads(self):
+        store = AtlassianConnectClient()
+        for i in range(20):
+            store.save({'clientKey': 'client%d' % i, 'sharedSecret': 'secret%d' % i})
+        errors = []
+
+        def worker(i):
+            for _ in range(200):
+                client = store.load('client%d' % i)
+                if client.sharedSecret != 'secret%d' % i:
+                    errors.append(i)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertIsNone(store.clientKey)
+
+    def test_load_many(self):
+        store = AtlassianConnectClient()
+        store.save({'clientKey': 'a', 'sharedSecret': 'one'})
+        store.save({'clientKey': 'b', 'sharedSecret': 'two'})
+        clients = store.load_many(['a', 'b', 'c'])
+        self.assertEqual(['a', 'b'], sorted(clients))
+        self.assertEqual('two', clients['b'].sharedSecret)
+
+    def test_save_if(self):
+        store = CachedClient(AtlassianConnectClient(), ClientCache())
+        record = ClientRecord(clientKey='a', sharedSecret='one')
+        self.assertEqual(1, store.save_if(record).version)
+        self.assertRaises(VersionConflict, store.save_if, record)
+        self.assertEqual(1, store.load('a').version)
+        self.assertEqual(2, store.save_if(record.replace(sharedSecret='two'), 1).version)
+        self.assertEqual('two', store.load('a').sharedSecret)
+        self.assertRaises(VersionConflict, store.save_if, record, 1)
+
+        # Clients saved without a version are at version 0
+        store.save(record)
+        self.assertRaises(VersionConflict, store.save_if, record, 2)
+        self.assertEqual(1, store.save_if(record, 0).version)
+
+
+def _stub_table():
+    """DynamoDB table resource that never talks to AWS"""
+    session = boto3.session.Session(
+        region_name='us-east-1',
+        aws_access_key_id='testing',
+        aws_secret_access_key='testing')
+    table = session.resource('dynamodb').Table('clients')
+    return table, Stubber(table.meta.client)
+
+
+def _item(client_key):
+    return {
+        'clientKey': {'S': client_key},
+        'sharedSecret': {'S': 'secret-' + client_key},
+        'baseUrl': {'S': 'https://%s.atlassian.net' % client_key},
+    }
+
+
+def _key(client_key):
+    return {'clientKey': client_key}
+
+
+class DynamoDBClientTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        table, self.stubber = _stub_table()
+        self.store = DynamoDBAtlassianConnectClient(table=table)
+        self.sleeps = []
+        self.store._sleep = self.sleeps.append
+
+    def test_load_does_not_mutate_store(self):
+        self.stubber.add_response(
+            'get_item', {'Item': _item('abc')},
+            {'TableName': 'clients', 'Key': _key('abc')})
+        with self.stubber:
+            client = self.store.load('abc')
+        self.assertEqual('secret-abc', client.sharedSecret)
+        self.assertIsNone(self.store.clientKey)
+
+    def test_load_many_chunks_and_retries(self):
+        keys = ['client%03d' % i for i in range(150)]
+        first = [_key(k) for k in keys[:100]]
+        self.stubber.add_response(
+            'batch_get_item',
+            {'Responses': {'clients': [_item(k) for k in keys[:98]]},
+             'UnprocessedKeys': {'clients': {'Keys': [
+                 {'clientKey': {'S': k}} for k in keys[98:100]]}}},
+            {'RequestItems': {'clients': {'Keys': first}}})
+        self.stubber.add_response(
+            'batch_get_item',
+            {'Responses': {'clients': [_item(k) for k in keys[98:100]]}},
+            {'RequestItems': {'clients': {'Keys': first[98:]}}})
+        self.stubber.add_response(
+            'batch_get_item',
+            {'Responses': {'clients': [_item(k) for k in keys[100:149]]}},
+            {'RequestItems': {'clients': {
+                'Keys': [_key(k) for k in keys[100:]]}}})
+        with self.stubber:
+            clients = self.store.load_many(keys + keys[:10])
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(149, len(clients))
+        self.assertNotIn('client149', clients)
+        self.assertEqual('secret-client099', clients['client099'].sharedSecret)
+        self.assertEqual(1, len(self.sleeps))
+
+    def test_save_if(self):
+        item = {'clientKey': 'abc', 'sharedSecret': 'secret', 'baseUrl': 'https://abc'}
+        self.stubber.add_response('put_item', {}, {
+            'TableName': 'clients', 'Item': dict(item, version=1),
+            'ConditionExpression': 'attribute_not_exists(clientKey)'})
+        self.stubber.add_client_error(
+            'put_item', service_error_code='ConditionalCheckFailedException',
+            expected_params={
+                'TableName': 'clients', 'Item': dict(item, version=3),
+                'ConditionExpression': '#version = :expected',
+                'ExpressionAttributeNames': {'#version': 'version'},
+                'ExpressionAttributeValues': {':expected': 2}})
+        self.stubber.add_response(
+            'get_item', {'Item': dict(_item('abc'), version={'N': '4'})},
+            {'TableName': 'clients', 'Key': _key('abc')})
+        with self.stubber:
+            self.assertEqual(1, self.store.save_if(item).version)
+            self.assertRaises(VersionConflict, self.store.save_if, item, 2)
+            self.assertEqual(4, self.store.load('abc').version)
+        self.stubber.assert_no_pending_responses()
+
+    def test_all_follows_pages(self):
+        projection = 'clientKey, sharedSecret, baseUrl, #version'
+        names = {'#version': 'version'}
+        self.stubber.add_response(
+            'scan',
+            {'Items': [_item('a'), dict(_item('b'), version={'N': '3'})],
+             'LastEvaluatedKey': {'clientKey': {'S': 'b'}}},
+            {'TableName': 'clients', 'ProjectionExpression': projection,
+             'ExpressionAttributeNames': names})
+        self.stubber.add_response(
+            'scan',
+            {'Items': [_item('c')]},
+            {'TableName': 'clients', 'ProjectionExpression': projection,
+             'ExpressionAttributeNames': names, 'ExclusiveStartKey': _key('b')})
+        with self.stubber:
+            clients = self.store.all()
+            self.assertEqual('a', next(clients).clientKey)
+            self.assertEqual([('b', 3), ('c', None)], [
+                (c.clientKey, getattr(c, 'version', None)) for c in clients])
+        self.stubber.assert_no_pending_responses()
+
+
+class _SegmentedTable(object):
+    """Stub table serving two pages per scan segment"""
+    name = 'clients'
+
+    def __init__(self):
+        self.calls = []
+
+    def scan(self, **kwargs):
+        self.calls.append(kwargs)
+        segment = kwargs['Segment']
+        page = 1 if 'ExclusiveStartKey' in kwargs else 0
+        items = [
+            {'clientKey': 'client-%d-%d-%d' % (segment, page, i),
+             'sharedSecret': 'secret', 'baseUrl': 'https://example.atlassian.net'}
+            for i in range(3)]
+        if page == 0:
+            return {'Items': items, 'LastEvaluatedKey': {'clientKey': items[-1]['clientKey']}}
+        return {'Items': items}
+
+
+class ParallelScanTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_segmented_scan(self):
+        table = _SegmentedTable()
+        store = DynamoDBAtlassianConnectClient(table=table)
+        clients = [c.clientKey for c in store.all(total_segments=4)]
+        self.assertEqual(24, len(clients))
+        self.assertEqual(24, len(set(clients)))
+        self.assertEqual(8, len(table.calls))
+        self.assertEqual(set([4]), set(c['TotalSegments'] for c in table.calls))
+
+    def test_stop_early(self):
+        store = DynamoDBAtlassianConnectClient(table=_SegmentedTable())
+        clients = store.all(total_segments=4)
+        next(clients)
+        clients.close()
+
+
+class SQLiteClientTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'clients.db')
+        self.store = SQLiteAtlassianConnectClient(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.store.save_many(
+            {'clientKey': 'client%03d' % i, 'sharedSecret': 'secret%d' % i,
+             'baseUrl': 'https://client%d.atlassian.net' % i} for i in range(150))
+        self.assertEqual('secret7', self.store.load('client007').sharedSecret)
+        self.assertIsNone(self.store.load('nope'))
+        clients = self.store.load_many(['client%03d' % i for i in range(120)] + ['nope'])
+        self.assertEqual(120, len(clients))
+        self.assertEqual(150, len(list(self.store.all())))
+
+        self.store.delete('client007')
+        self.assertIsNone(self.store.load('client007'))
+        other = SQLiteAtlassianConnectClient(self.path)
+        self.assertEqual(149, len(list(other.all())))
+        self.assertEqual(
+            'wal', other._connection().execute('PRAGMA journal_mode').fetchone()[0])
+
+    def test_save_if(self):
+        record = ClientRecord(clientKey='a', sharedSecret='one', baseUrl='https://a')
+        self.assertEqual(1, self.store.save_if(record).version)
+        self.assertRaises(VersionConflict, self.store.save_if, record)
+        self.assertEqual(2, self.store.save_if(record.replace(sharedSecret='two'), 1).version)
+        self.assertEqual(
+            ClientRecord(clientKey='a', sharedSecret='two', baseUrl='https://a', version=2),
+            self.store.load('a'))
+        self.assertRaises(VersionConflict, self.store.save_if, record, 1)
+        self.store.save(record)
+        self.assertEqual(1, self.store.save_if(record, 0).version)
+
+    def test_threads(self):
+        errors = []
+
+        def worker(i):
+            try:
+                for j in range(20):
+                    self.store.save({'clientKey': 'client%d-%d' % (i, j), 'sharedSecret': 's'})
+                    if self.store.load('client%d-%d' % (i, j)) is None:
+                        errors.append((i, j))
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(160, len(list(self.store.all())))
+
+    def test_from_config(self):
+        config = dict(CONFIG, SQLITE_PATH=self.path)
+        ac = AtlassianConnect(
+            Chalice('app'), client_class=SQLiteAtlassianConnectClient, config=config)
+        ac.client_class.save({'clientKey': 'a', 'sharedSecret': 'one'})
+        self.assertEqual('one', self.store.load('a').sharedSecret)
+
+
+class TasksTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_list_streams_ndjson(self):
+        ac = AtlassianConnect(Chalice("app"), config=CONFIG)
+        ac.client_class.save({'clientKey': 'a', 'sharedSecret': 'one'})
+        ac.client_class.save({'clientKey': 'b', 'sharedSecret': 'two'})
+        with mock.patch('sys.stdout') as stdout:
+            ac.tasks().tasks['list'](Context(), segments=2)
+        output = ''.join(call[0][0] for call in stdout.write.call_args_list)
+        lines = output.splitlines()
+        self.assertEqual(
+            [{'clientKey': 'a', 'sharedSecret': 'one'},
+             {'clientKey': 'b', 'sharedSecret': 'two'}],
+            [json.loads(line) for line in lines])
+
+
+class LifecycleTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(self.app, config=CONFIG)
+        self.installed = []
+        self.ac.lifecycle('installed')(lambda client: self.installed.append(client))
+        self.ac.lifecycle('uninstalled')(lambda: None)
+        self.ac.client_class.save(ClientRecord(clientKey='other', sharedSecret='x'))
+
+    @requests_mock.Mocker()
+    def test_install_and_uninstall(self, m):
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        payload = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret',
+            productType='jira')
+        with Client(self.app) as client:
+            response = client.http.post(
+                '/lifecycle/installed',
+                body=json.dumps(payload),
+                headers={'Content-Type': 'application/json'})
+            self.assertEqual(204, response.status_code)
+            self.assertEqual('myscret', self.ac.client_class.load('abc123').sharedSecret)
+            self.assertEqual('jira', self.installed[0].productType)
+            # Installing didn't touch other tenants
+            self.assertEqual('x', self.ac.client_class.load('other').sharedSecret)
+
+            response = client.http.post(
+                '/lifecycle/uninstalled',
+                body=json.dumps(payload),
+                headers={'Content-Type': 'application/json'})
+            self.assertEqual(401, response.status_code)
+
+            auth = encode_token('POST', '/lifecycle/uninstalled', 'abc123', 'myscret')
+            response = client.http.post(
+                '/lifecycle/uninstalled',
+                body=json.dumps(payload),
+                headers={'Content-Type': 'application/json',
+                         'Authorization': 'JWT ' + auth})
+            self.assertEqual(204, response.status_code)
+        self.assertIsNone(self.ac.client_class.load('abc123'))
+        self.assertIsNotNone(self.ac.client_class.load('other'))
+
+    @requests_mock.Mocker()
+    def test_reinstall_needs_signature(self, m):
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        payload = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        headers = {'Content-Type': 'application/json'}
+        with Client(self.app) as client:
+            for auth, status in ((None, 204), (None, 401),
+                                 ('some other secret', 401), ('myscret', 204)):
+                if auth:
+                    token = encode_token('POST', '/lifecycle/installed', 'abc123', auth)
+                    headers['Authorization'] = 'JWT ' + token
+                response = client.http.post(
+                    '/lifecycle/installed', body=json.dumps(payload), headers=headers)
+                self.assertEqual(status, response.status_code)
+
+    @requests_mock.Mocker()
+    def test_install_races(self, m):
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        store = self.ac.client_class
+        loads = []
+        payload = dict(
+            baseUrl='https://gavindev.atlassian.net',
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+
+        def racing_load(client_key):
+            client = AtlassianConnectClient.load(store, client_key)
+            loads.append(client_key)
+            # Another install lands between reading and writing
+            store.save_if(client, client.version)
+            return client
+        store.load = racing_load
+
+        with Client(self.app) as client:
+            response = client.http.post(
+                '/lifecycle/installed', body=json.dumps(payload),
+                headers={'Content-Type': 'application/json'})
+            self.assertEqual(204, response.status_code)
+            self.assertEqual([], loads)
+            self.assertEqual(1, self.installed[0].version)
+
+            auth = encode_token('POST', '/lifecycle/installed', 'abc123', 'myscret')
+            response = client.http.post(
+                '/lifecycle/installed', body=json.dumps(payload),
+                headers={'Content-Type': 'application/json',
+                         'Authorization': 'JWT ' + auth})
+            self.assertEqual(409, response.status_code)
+            self.assertEqual(['abc123'], loads)
+        self.assertEqual(1, len(self.installed))
+
+    @requests_mock.Mocker()
+    def test_reinstall_past_stale_caches(self, m):
+        m.get('https://gavindev.atlassian.net/plugins/servlet/oauth/consumer-info',
+              text=consumer_info_response)
+        # Two processes with their own caches over one store
+        store = AtlassianConnectClient()
+        store.save_if(ClientRecord(clientKey='abc123', sharedSecret='s1'))
+        apps = []
+        for _ in range(2):
+            app = Chalice('app')
+            ac = AtlassianConnect(
+                app, config=CONFIG, client_class=lambda: store, client_cache=ClientCache())
+            ac.lifecycle('installed')(lambda client: None)
+            ac.client_class.load('abc123')
+            apps.append(app)
+
+        def reinstall(app, old_secret, new_secret):
+            payload = dict(
+                baseUrl='https://gavindev.atlassian.net',
+                clientKey='abc123',
+                publicKey='public123',
+                sharedSecret=new_secret)
+            auth = encode_token('POST', '/lifecycle/installed', 'abc123', old_secret)
+            with Client(app) as client:
+                return client.http.post(
+                    '/lifecycle/installed', body=json.dumps(payload),
+                    headers={'Content-Type': 'application/json',
+                             'Authorization': 'JWT ' + auth}).status_code
+
+        # Each one verifies against the rotated secret, and writes against
+        # the version the other one saved
+        self.assertEqual(204, reinstall(apps[1], 's1', 's2'))
+        self.assertEqual(204, reinstall(apps[0], 's2', 's3'))
+        self.assertEqual(204, reinstall(apps[1], 's3', 's4'))
+        self.assertEqual(401, reinstall(apps[0], 's3', 's5'))
+        self.assertEqual(('s4', 4), (store.load('abc123').sharedSecret, store.load('abc123').version))
+
+    def test_uninstall_unknown_client(self):
+        auth = encode_token('POST', '/lifecycle/uninstalled', 'gone', 'myscret')
+        with Client(self.app) as client:
+            response = client.http.post(
+                '/lifecycle/uninstalled',
+                body=json.dumps({'clientKey': 'gone'}),
+                headers={'Content-Type': 'application/json',
+                         'Authorization': 'JWT ' + auth})
+        self.assertEqual(401, response.status_code)
+        self.assertIsNotNone(self.ac.client_class.load('other'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect
+from .test_auth import CONFIG
+
+
+def decorator_noop(**kwargs):
+    """NOOOOOOO OPERATION"""
+    del kwargs
+
+
+class DescriptorTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(self.app, config=CONFIG)
+        self.ac.module(key="configurePage")(decorator_noop)
+
+    def _get(self, host='example.com', **headers):
+        headers['host'] = host
+        with Client(self.app) as client:
+            return client.http.get('/atlassian-connect.json', headers=headers)
+
+    def test_descriptor(self):
+        response = self._get()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('http://example.com', response.json_body['baseUrl'])
+        self.assertEqual(
+            'http://example.com/atlassian-connect.json',
+            response.json_body['links']['self'])
+        self.assertIn('configurePage', response.json_body['modules'])
+        # The registered descriptor itself is left alone
+        self.assertNotIn('baseUrl', self.ac.descriptor)
+
+    def test_descriptor_per_host(self):
+        response = self._get(host='other.example.com', **{'x-forwarded-proto': 'https'})
+        self.assertEqual('https://other.example.com', response.json_body['baseUrl'])
+        self.assertEqual('http://example.com', self._get().json_body['baseUrl'])
+        self.assertEqual(2, len(self.ac._descriptor_cache))
+
+    def test_not_modified(self):
+        etag = self._get().headers['ETag']
+        response = self._get(**{'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.body)
+
+    def test_new_module_invalidates(self):
+        etag = self._get().headers['ETag']
+        self.ac.module(key="otherPage")(decorator_noop)
+        response = self._get(**{'If-None-Match': etag})
+        self.assertEqual(200, response.status_code)
+        self.assertIn('otherPage', response.json_body['modules'])
+        self.assertNotEqual(etag, response.headers['ETag'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import json
+import threading
+import unittest
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+from chalice import Chalice
+from .. import AtlassianConnect, ClientRecord
+from .. import client as client_module
+from ..client import DynamoDBAtlassianConnectClient
+from .test_auth import CONFIG
+from .test_session import _ThreadingServer
+
+try:
+    from http.server import BaseHTTPRequestHandler
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+
+
+class _StubDynamoDB(BaseHTTPRequestHandler):
+    """Local DynamoDB stand-in for GetItem, PutItem and DeleteItem"""
+    protocol_version = 'HTTP/1.1'
+    items = {}
+    requests = []
+
+    def do_POST(self):
+        cls = type(self)
+        operation = self.headers['X-Amz-Target'].split('.')[-1]
+        params = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+        cls.requests.append((operation, params['TableName'], self.client_address[1]))
+        key = (params['TableName'], json.dumps(params.get('Key') or {
+            'clientKey': params.get('Item', {}).get('clientKey')}))
+        body = {}
+        if operation == 'GetItem' and key in cls.items:
+            body = {'Item': cls.items[key]}
+        elif operation == 'PutItem':
+            cls.items[key] = params['Item']
+        elif operation == 'DeleteItem':
+            cls.items.pop(key, None)
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SharedResourceTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        _StubDynamoDB.items = {}
+        _StubDynamoDB.requests = []
+        self.server = _ThreadingServer(('127.0.0.1', 0), _StubDynamoDB)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.config = dict(
+            CONFIG,
+            DYNAMODB_TABLE='clients',
+            DYNAMODB_REGION='us-east-1',
+            DYNAMODB_ENDPOINT_URL='http://127.0.0.1:%d' % self.server.server_port,
+            DYNAMODB_POOL_SIZE=4)
+        self.env = mock.patch.dict(
+            'os.environ', AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing')
+        self.env.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.env.stop()
+        with client_module._resources_lock:
+            client_module._resources.clear()
+
+    def test_round_trip(self):
+        ac = AtlassianConnect(Chalice('app'), client_class=DynamoDBAtlassianConnectClient,
+                              config=self.config)
+        ac.client_class.save(ClientRecord(
+            clientKey='abc', sharedSecret='secret', baseUrl='https://abc.atlassian.net'))
+        self.assertEqual('secret', ac.client_class.load('abc').sharedSecret)
+        ac.client_class.delete('abc')
+        self.assertIsNone(ac.client_class.load('abc'))
+        self.assertEqual(
+            ['PutItem', 'GetItem', 'DeleteItem', 'GetItem'],
+            [operation for operation, _, _ in _StubDynamoDB.requests])
+        self.assertEqual(set(['clients']), set(t for _, t, _ in _StubDynamoDB.requests))
+        # Calls reuse a kept alive connection
+        self.assertEqual(1, len(set(port for _, _, port in _StubDynamoDB.requests)))
+
+    def test_resource_shared(self):
+        first = DynamoDBAtlassianConnectClient.from_config(self.config)
+        second = DynamoDBAtlassianConnectClient.from_config(self.config)
+        self.assertIs(first.table.meta.client, second.table.meta.client)
+        config = first.table.meta.client.meta.config
+        self.assertEqual(4, config.max_pool_connections)
+        self.assertEqual('adaptive', config.retries['mode'])
+        self.assertEqual(5, config.read_timeout)
+
+        other = DynamoDBAtlassianConnectClient.from_config(dict(self.config, DYNAMODB_POOL_SIZE=8))
+        self.assertIsNot(first.table.meta.client, other.table.meta.client)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import boto3
+from botocore.stub import ANY, Stubber
+from cryptography.exceptions import InvalidTag
+from ..client import ClientRecord, DynamoDBAtlassianConnectClient
+from ..encryption import KMSKeyProvider, LocalKeyProvider, SecretCipher
+from .test_cache import _Clock
+from .test_client import _key, _stub_table
+
+
+class _CountingProvider(object):
+    """Key provider counting the calls that would go to KMS"""
+    def __init__(self, provider):
+        self.provider = provider
+        self.generated = 0
+        self.decrypted = 0
+
+    def generate_data_key(self):
+        self.generated += 1
+        return self.provider.generate_data_key()
+
+    def decrypt_data_key(self, wrapped):
+        self.decrypted += 1
+        return self.provider.decrypt_data_key(wrapped)
+
+
+class EncryptionTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.key_file = os.path.join(self.directory, 'master.key')
+        self.provider = _CountingProvider(LocalKeyProvider(self.key_file))
+        self.clock = _Clock()
+        self.cipher = SecretCipher(self.provider, data_key_ttl=300, timer=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_local_key_file(self):
+        self.cipher.encrypt('secret')
+        self.assertEqual(32, os.path.getsize(self.key_file))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.key_file).st_mode))
+        self.assertEqual(self.provider.provider.key, LocalKeyProvider(self.key_file).key)
+
+    def test_round_trip_without_provider_calls(self):
+        encrypted = [self.cipher.encrypt('secret%d' % i) for i in range(3)]
+        self.assertNotIn('secret0', encrypted[0])
+        self.assertNotEqual(encrypted[0], self.cipher.encrypt('secret0'))
+        self.assertEqual(
+            ['secret0', 'secret1', 'secret2'], [self.cipher.decrypt(e) for e in encrypted])
+        self.assertEqual((1, 0), (self.provider.generated, self.provider.decrypted))
+
+        # Another process unwraps each data key once
+        other = SecretCipher(self.provider, timer=self.clock)
+        for _ in range(2):
+            self.assertEqual(
+                ['secret0', 'secret1', 'secret2'], [other.decrypt(e) for e in encrypted])
+        self.assertEqual(1, self.provider.decrypted)
+
+    def test_data_key_rotation(self):
+        first = self.cipher.encrypt('secret')
+        self.clock.now += 301
+        second = self.cipher.encrypt('secret')
+        self.assertEqual(2, self.provider.generated)
+        self.assertNotEqual(first.split(':')[1], second.split(':')[1])
+        self.assertEqual('secret', SecretCipher(self.provider).decrypt(first))
+
+    def test_context(self):
+        encrypted = self.cipher.encrypt('secret', 'tenant-a')
+        self.assertEqual('secret', self.cipher.decrypt(encrypted, 'tenant-a'))
+        # Not even once decrypted and cached for another context
+        for context in ('tenant-b', None):
+            self.assertRaises(InvalidTag, self.cipher.decrypt, encrypted, context)
+        self.assertRaises(InvalidTag, self.cipher.decrypt, self.cipher.encrypt('secret'), 'tenant-a')
+
+    def test_plaintext_passes_through(self):
+        self.assertEqual('legacy', self.cipher.decrypt('legacy'))
+        self.assertIsNone(self.cipher.decrypt(None))
+
+
+class KMSKeyProviderTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_data_keys(self):
+        client = boto3.session.Session(
+            region_name='us-east-1',
+            aws_access_key_id='testing',
+            aws_secret_access_key='testing').client('kms')
+        stubber = Stubber(client)
+        stubber.add_response(
+            'generate_data_key', {'Plaintext': b'k' * 32, 'CiphertextBlob': b'wrapped'},
+            {'KeyId': 'alias/addon', 'KeySpec': 'AES_256'})
+        stubber.add_response(
+            'decrypt', {'Plaintext': b'k' * 32},
+            {'KeyId': 'alias/addon', 'CiphertextBlob': b'wrapped'})
+        cipher = SecretCipher(KMSKeyProvider('alias/addon', client=client))
+        with stubber:
+            encrypted = cipher.encrypt('secret')
+            self.assertEqual('secret', SecretCipher(cipher.provider).decrypt(encrypted))
+        stubber.assert_no_pending_responses()
+
+
+class EncryptedStoreTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_dynamodb(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        cipher = SecretCipher(LocalKeyProvider(os.path.join(directory, 'master.key')))
+        table, stubber = _stub_table()
+        store = DynamoDBAtlassianConnectClient(table=table, cipher=cipher)
+        stored = cipher.encrypt('secret', 'abc')
+        stubber.add_response('put_item', {}, {
+            'TableName': 'clients',
+            'Item': {'clientKey': 'abc', 'sharedSecret': ANY, 'baseUrl': 'https://abc'}})
+        stubber.add_response(
+            'get_item',
+            {'Item': {'clientKey': {'S': 'abc'}, 'sharedSecret': {'S': stored},
+                      'baseUrl': {'S': 'https://abc'}}},
+            {'TableName': 'clients', 'Key': _key('abc')})
+        with stubber:
+            store.save({'clientKey': 'abc', 'sharedSecret': 'secret', 'baseUrl': 'https://abc'})
+            self.assertEqual('secret', store.load('abc').sharedSecret)
+        stubber.assert_no_pending_responses()
+        record = ClientRecord(clientKey='abc', sharedSecret='secret')
+        self.assertTrue(store._stored_secret(record).startswith('enc1:'))
+
+        # Another tenant's ciphertext copied into this item doesn't decrypt
+        stubber.add_response(
+            'get_item',
+            {'Item': {'clientKey': {'S': 'xyz'}, 'sharedSecret': {'S': stored},
+                      'baseUrl': {'S': 'https://xyz'}}},
+            {'TableName': 'clients', 'Key': _key('xyz')})
+        with stubber:
+            self.assertRaises(InvalidTag, store.load, 'xyz')
+
+    def test_from_config(self):
+        self.assertIsNone(DynamoDBAtlassianConnectClient.from_config({}).cipher)
+        store = DynamoDBAtlassianConnectClient.from_config({'SECRETS_KMS_KEY_ID': 'alias/addon'})
+        self.assertEqual('alias/addon', store.cipher.provider.key_id)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, ClientCache, ClientRecord
+from ..host import AddonHost
+from .test_auth import CONFIG
+from atlassian_jwt.encode import encode_token
+
+
+class AddonHostTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice('app')
+        self.host = AddonHost(self.app, client_cache=ClientCache())
+        self.addons = {}
+        for prefix in ('jira', 'confluence'):
+            addon = AtlassianConnect(
+                host=self.host, root_url='/' + prefix,
+                config=dict(CONFIG, ADDON_KEY=prefix + '-addon'))
+            # The same client key, installed with a different secret in each
+            addon.client_class.save(ClientRecord(clientKey='abc', sharedSecret=prefix + '-secret'))
+            addon.client_class.save(ClientRecord(clientKey=prefix, sharedSecret='secret'))
+            self._module(addon, prefix)
+            self.addons[prefix] = addon
+
+    def _module(self, addon, prefix):
+        @addon.module(key='configurePage')
+        def configure_page(client):
+            context = self.app.context_processor()
+            return {'addon': prefix, 'post_url': context['atlassian_jwt_post_url']}
+
+    def _get(self, path, secret, client_key='abc'):
+        auth = encode_token('GET', path, client_key, secret)
+        with Client(self.app) as client:
+            return client.http.get(path, headers={'Authorization': 'JWT ' + auth})
+
+    def test_dispatch(self):
+        for prefix in ('jira', 'confluence'):
+            response = self._get('/%s/modules/configurePage' % prefix, prefix + '-secret')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(prefix, response.json_body['addon'])
+            self.assertTrue(response.json_body['post_url'].startswith(
+                '/%s/modules/configurePage?jwt=' % prefix))
+        # Each add-on only knows its own clients
+        self.assertEqual(
+            401, self._get('/jira/modules/configurePage', 'secret', 'confluence').status_code)
+        self.assertEqual(404, self._get('/other/modules/configurePage', 'x').status_code)
+
+    def test_descriptors(self):
+        with Client(self.app) as client:
+            for prefix in ('jira', 'confluence'):
+                descriptor = client.http.get(
+                    '/%s/atlassian-connect.json' % prefix,
+                    headers={'Host': 'addons.example.com'}).json_body
+                self.assertEqual(prefix + '-addon', descriptor['key'])
+                self.assertEqual(
+                    'http://addons.example.com/%s/atlassian-connect.json' % prefix,
+                    descriptor['links']['self'])
+                self.assertEqual(
+                    '/%s/modules/configurePage' % prefix,
+                    descriptor['modules']['configurePage']['url'])
+        self.assertEqual(['/jira', '/confluence'], self.app.root_urls)
+
+    def test_shared_resources(self):
+        jira, confluence = self.addons['jira'], self.addons['confluence']
+        self.assertIs(self.host.http, jira.http)
+        self.assertIs(self.host.http, confluence.http)
+        self.assertEqual('jira-secret', jira.client_class.load('abc').sharedSecret)
+        self.assertEqual('confluence-secret', confluence.client_class.load('abc').sharedSecret)
+        self.assertEqual(2, len(self.host.client_cache))
+        confluence.client_class.save(ClientRecord(clientKey='abc', sharedSecret='rotated'))
+        self.assertEqual(1, len(self.host.client_cache))
+        self.assertEqual('rotated', confluence.client_class.load('abc').sharedSecret)
+        self.assertEqual('jira-secret', jira.client_class.load('abc').sharedSecret)
+
+    def test_root_urls(self):
+        for root_url in ('', '/', '/a/b', '/jira'):
+            self.assertRaises(
+                ValueError, AtlassianConnect, host=self.host, root_url=root_url, config=CONFIG)
+
+
+if __name__ == '__main__':
+    unittest.main()
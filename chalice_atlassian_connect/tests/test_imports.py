@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import unittest
+from .test_auth import CONFIG
+
+_CHECK = """
+import sys
+import chalice_atlassian_connect
+from chalice import Chalice
+ac = chalice_atlassian_connect.AtlassianConnect(Chalice('app'), config=%r)
+print(' '.join(m for m in %r if m in sys.modules))
+"""
+
+
+class LazyImportTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_heavy_dependencies_deferred(self):
+        heavy = ('boto3', 'botocore', 'requests', 'urllib3', 'jwt',
+                 'atlassian_jwt', 'concurrent.futures')
+        output = subprocess.check_output(
+            [sys.executable, '-c', _CHECK % (CONFIG, heavy)])
+        self.assertEqual('', output.decode('utf-8').strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import unittest
+from io import StringIO
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, ClientRecord
+from ..metrics import EMFLogSink, Instrumentation
+from .test_auth import CONFIG
+from atlassian_jwt.encode import encode_token
+
+
+class _Clock(object):
+    """Clock moving a millisecond every time it is read"""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 0.001
+        return self.now
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.timings = []
+        self.stream = StringIO()
+        self.app = Chalice('app')
+        self.ac = AtlassianConnect(self.app, config=CONFIG, instrumentation=Instrumentation(
+            sinks=[self.timings.append, EMFLogSink(stream=self.stream, timer=lambda: 1000)],
+            server_timing=True, clock=_Clock()))
+        self.ac.client_class.save(ClientRecord(clientKey='abc', sharedSecret='myscret'))
+
+        @self.ac.module(key='configurePage')
+        def configure_page(client):
+            return {'clientKey': client.clientKey}
+
+    def _get(self, client_key='abc'):
+        auth = encode_token('GET', '/modules/configurePage', client_key, 'myscret')
+        with Client(self.app) as client:
+            return client.http.get(
+                '/modules/configurePage', headers={'Authorization': 'JWT ' + auth})
+
+    def test_stages(self):
+        response = self._get()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'clientKey': 'abc'}, response.json_body)
+        timing, = self.timings
+        self.assertEqual(('modules', 'configurePage', 'abc', 200), (
+            timing.section, timing.handler, timing.client_key, timing.status_code))
+        # Each stage reads the clock twice, the jwt stage excludes loading
+        self.assertEqual(
+            [('jwt', 2.0), ('load', 1.0), ('handler', 1.0), ('serialize', 1.0), ('total', 8.0)],
+            timing.milliseconds())
+        self.assertEqual(
+            'jwt;dur=2.0, load;dur=1.0, handler;dur=1.0, serialize;dur=1.0, total;dur=8.0',
+            response.headers['Server-Timing'])
+
+    def test_emf(self):
+        self._get()
+        record = json.loads(self.stream.getvalue())
+        self.assertEqual(1000000, record['_aws']['Timestamp'])
+        metrics = record['_aws']['CloudWatchMetrics'][0]
+        self.assertEqual([['section', 'handler']], metrics['Dimensions'])
+        self.assertEqual(
+            ['ms_jwt', 'ms_load', 'ms_handler', 'ms_serialize', 'ms_total'],
+            [metric['Name'] for metric in metrics['Metrics']])
+        self.assertEqual('modules', record['section'])
+        self.assertEqual('configurePage', record['handler'])
+        self.assertEqual('abc', record['clientKey'])
+        self.assertEqual((1.0, 8.0), (record['ms_handler'], record['ms_total']))
+
+    def test_failed_request(self):
+        self.assertEqual(401, self._get(client_key='gone').status_code)
+        timing, = self.timings
+        self.assertEqual(401, timing.status_code)
+        self.assertIsNone(timing.client_key)
+
+    def test_disabled(self):
+        app = Chalice('app')
+        ac = AtlassianConnect(app, config=CONFIG)
+        ac.client_class.save(ClientRecord(clientKey='abc', sharedSecret='myscret'))
+
+        @ac.module(key='configurePage')
+        def configure_page(client):
+            return {}
+        self.app = app
+        self.assertNotIn('Server-Timing', self._get().headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import json
+import threading
+import unittest
+import jwt
+from chalice import Chalice
+from .. import AtlassianConnect, ClientRecord
+from .test_auth import CONFIG
+from .test_session import _ThreadingServer
+from atlassian_jwt.url_utils import hash_url
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urlparse import parse_qs, urlsplit
+
+ISSUES = ['TEST-%d' % i for i in range(7)]
+
+
+def _page(path):
+    """Pages of ISSUES, as offset, cursor or linked pages"""
+    url = urlsplit(path)
+    query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+    if url.path == '/rest/api/2/search':
+        start, size = int(query['startAt']), min(int(query['maxResults']), 3)
+        issues = [{'key': key, 'fields': query.get('fields')} for key in ISSUES[start:start + size]]
+        return {'startAt': start, 'maxResults': size, 'total': len(ISSUES), 'issues': issues}
+    start, size = int(query.get('nextPageToken', query.get('cursor', 0))), int(query['limit'])
+    page = {'results': ISSUES[start:start + size]}
+    if start + size < len(ISSUES):
+        if url.path == '/rest/api/3/search/jql':
+            page['nextPageToken'] = str(start + size)
+        else:
+            page['_links'] = {'next': '/jira%s?cursor=%d&limit=%d' % (url.path, start + size, size)}
+    return page
+
+
+class _StubJira(BaseHTTPRequestHandler):
+    """Checks request signatures, rate limiting the first requests if asked to"""
+    protocol_version = 'HTTP/1.1'
+    rate_limited = 0
+    retry_after = None
+    requests = []
+
+    def do_GET(self):
+        cls = type(self)
+        token = self.headers['Authorization'].split(' ', 1)[1]
+        claims = jwt.decode(token, 'myscret', algorithms=['HS256'],
+                            options={'verify_aud': False})
+        path = self.path[len('/jira'):]
+        cls.requests.append((path, token, self.client_address[1]))
+        if claims['iss'] != CONFIG['ADDON_KEY'] or claims['qsh'] != hash_url('GET', path):
+            status, body = 401, b''
+        elif cls.rate_limited:
+            cls.rate_limited -= 1
+            status, body = 429, b''
+        elif path.startswith('/rest/api/2/myself'):
+            status, body = 200, json.dumps({'path': path}).encode('utf-8')
+        else:
+            status, body = 200, json.dumps(_page(path)).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429 and cls.retry_after is not None:
+            self.send_header('Retry-After', cls.retry_after)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class RestClientTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        _StubJira.rate_limited = 0
+        _StubJira.retry_after = None
+        _StubJira.requests = []
+        self.server = _ThreadingServer(('127.0.0.1', 0), _StubJira)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.ac = AtlassianConnect(Chalice('app'), config=CONFIG)
+        self.client = ClientRecord(
+            clientKey='abc', sharedSecret='myscret',
+            baseUrl='http://127.0.0.1:%d/jira/' % self.server.server_port)
+        self.sleeps = []
+
+    def tearDown(self):
+        self.ac.http.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _rest(self):
+        rest = self.ac.rest(self.client)
+        rest._sleep = self.sleeps.append
+        return rest
+
+    def test_signed_and_pooled(self):
+        for _ in range(2):
+            response = self._rest().get('/rest/api/2/myself', params={'jql': 'project = TEST', 'a': 1})
+            self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            '/rest/api/2/myself?a=1&jql=project+%3D+TEST', response.json()['path'])
+        self._rest().get('/rest/api/2/myself/TEST-1')
+        tokens = [token for _, token, _ in _StubJira.requests]
+        self.assertEqual(tokens[0], tokens[1])
+        self.assertNotEqual(tokens[0], tokens[2])
+        self.assertEqual(1, len(set(port for _, _, port in _StubJira.requests)))
+
+    def test_rate_limited(self):
+        _StubJira.rate_limited = 2
+        _StubJira.retry_after = '2'
+        self.assertEqual(200, self._rest().get('/rest/api/2/myself').status_code)
+        self.assertEqual([2, 2], self.sleeps)
+
+        _StubJira.rate_limited = 1
+        _StubJira.retry_after = None
+        self.assertEqual(200, self._rest().get('/rest/api/2/myself').status_code)
+        self.assertEqual(3, len(self.sleeps))
+
+    def test_rate_limited_too_long(self):
+        _StubJira.rate_limited = 5
+        _StubJira.retry_after = '3600'
+        self.assertEqual(429, self._rest().get('/rest/api/2/myself').status_code)
+        _StubJira.retry_after = '0'
+        self.assertEqual(429, self._rest().get('/rest/api/2/myself').status_code)
+        self.assertEqual([0, 0, 0], self.sleeps)
+
+    def test_paginate(self):
+        for prefetch in (True, False):
+            issues = list(self._rest().paginate(
+                '/rest/api/2/search', items_key='issues', params={'jql': 'project = TEST'},
+                page_size=50, fields=['summary', 'status'], prefetch=prefetch))
+            self.assertEqual(ISSUES, [issue['key'] for issue in issues])
+            self.assertEqual('summary,status', issues[0]['fields'])
+        # The server capped pages at 3 issues
+        self.assertEqual(6, len(_StubJira.requests))
+
+    def test_paginate_stops_early(self):
+        issues = self._rest().paginate('/rest/api/2/search', items_key='issues', page_size=3)
+        self.assertEqual('TEST-0', next(issues)['key'])
+        issues.close()
+        # At most the second page was prefetched, nothing beyond it
+        self.assertIn(len(_StubJira.requests), (1, 2))
+
+    def test_paginate_cursor(self):
+        results = self._rest().paginate_cursor(
+            '/rest/api/3/search/jql', items_key='results', page_size=2, limit_param='limit')
+        self.assertEqual(ISSUES, list(results))
+        self.assertEqual(4, len(_StubJira.requests))
+
+    def test_paginate_links(self):
+        results = self._rest().paginate_cursor(
+            '/api/v2/pages', items_key='results', page_size=4, cursor_key=None,
+            limit_param='limit')
+        self.assertEqual(ISSUES, list(results))
+        self.assertEqual(
+            ['/api/v2/pages?limit=4', '/api/v2/pages?cursor=4&limit=4'],
+            [path for path, _, _ in _StubJira.requests])
+
+
+if __name__ == '__main__':
+    unittest.main()
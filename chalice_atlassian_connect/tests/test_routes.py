@@ -0,0 +1,59 @@
+import unittest
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, ClientRecord
+from .test_auth import CONFIG
+from atlassian_jwt.encode import encode_token
+
+
+class DirectRoutesTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(self.app, config=CONFIG, direct_routes=True)
+        self.ac.client_class.save(ClientRecord(clientKey='abc', sharedSecret='myscret'))
+
+        @self.ac.module(key="configurePage")
+        def configure_page(client):
+            return {'clientKey': client.clientKey}
+
+        @self.ac.webhook('jira:issue_created')
+        def issue_created(client, event):
+            pass
+
+        self.ac.lifecycle('installed')(lambda client: None)
+
+    def _request(self, method, path):
+        auth = encode_token(method, path, 'abc', 'myscret')
+        with Client(self.app) as client:
+            return client.http.request(
+                method, path, headers={'Authorization': 'JWT ' + auth})
+
+    def test_routes(self):
+        self.assertNotIn('/{section}/{name}', self.app.routes)
+        self.assertEqual(['GET', 'POST'], sorted(self.app.routes['/modules/configurePage']))
+        self.assertEqual(['POST'], list(self.app.routes['/webhooks/jiraissue_created']))
+        self.assertEqual(['POST'], list(self.app.routes['/lifecycle/installed']))
+        self.assertEqual('/modules/configurePage', self.ac.url_for('configure_page'))
+
+    def test_dispatch(self):
+        response = self._request('GET', '/modules/configurePage')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'clientKey': 'abc'}, response.json_body)
+        self.assertEqual(204, self._request('POST', '/webhooks/jiraissue_created').status_code)
+
+    def test_rejected_by_router(self):
+        self.assertEqual(405, self._request('GET', '/webhooks/jiraissue_created').status_code)
+        self.assertNotEqual(200, self._request('GET', '/modules/nope').status_code)
+        self.assertNotEqual(200, self._request('GET', '/nope/configurePage').status_code)
+
+    def test_late_init(self):
+        ac = AtlassianConnect(config=CONFIG, direct_routes=True)
+        ac.module(key="configurePage")(lambda client: None)
+        app = Chalice("app")
+        ac.init_app(app, '', CONFIG)
+        self.assertIn('/modules/configurePage', app.routes)
+
+
+if __name__ == '__main__':
+    unittest.main()
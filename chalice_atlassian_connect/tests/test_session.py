@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+import unittest
+import requests
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect
+from ..cache import ConsumerInfoCache
+from ..session import HttpClient
+from .test_auth import CONFIG
+from .test_client import consumer_info_response
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+class _ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _StubAtlassian(BaseHTTPRequestHandler):
+    """Serves consumer-info, failing or stalling first if asked to"""
+    protocol_version = 'HTTP/1.1'
+    failures = 0
+    delay = 0
+    cache_control = None
+    requests = []
+
+    def do_GET(self):
+        cls = type(self)
+        cls.requests.append((self.path, self.client_address[1]))
+        time.sleep(cls.delay)
+        if cls.failures:
+            cls.failures -= 1
+            status, body = 503, b''
+        else:
+            status, body = 200, consumer_info_response.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if cls.cache_control:
+            self.send_header('Cache-Control', cls.cache_control)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _StubServerTestCase(unittest.TestCase):
+    """Runs a stub Atlassian instance for each test"""
+    def setUp(self):
+        _StubAtlassian.failures = 0
+        _StubAtlassian.delay = 0
+        _StubAtlassian.cache_control = None
+        _StubAtlassian.requests = []
+        self.server = _ThreadingServer(('127.0.0.1', 0), _StubAtlassian)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class HttpClientTestCase(_StubServerTestCase):
+    """Test Case"""
+    def test_keep_alive(self):
+        http = HttpClient()
+        for _ in range(3):
+            self.assertEqual(200, http.get(self.base_url + '/').status_code)
+        ports = set(port for _, port in _StubAtlassian.requests)
+        self.assertEqual(1, len(ports))
+
+    def test_retries_server_errors(self):
+        _StubAtlassian.failures = 2
+        http = HttpClient(retries=3, backoff_factor=0.01)
+        self.assertEqual(200, http.get(self.base_url + '/').status_code)
+        self.assertEqual(3, len(_StubAtlassian.requests))
+
+    def test_timeout(self):
+        _StubAtlassian.delay = 0.5
+        http = HttpClient(timeout=(1, 0.1), retries=0)
+        self.assertRaises(requests.Timeout, http.get, self.base_url + '/')
+
+    def test_installed_uses_injected_client(self):
+        app = Chalice("app")
+        ac = AtlassianConnect(app, config=CONFIG, http=HttpClient(retries=0))
+        ac.lifecycle('installed')(lambda client: None)
+        payload = dict(
+            baseUrl=self.base_url,
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        with Client(app) as client:
+            response = client.http.post(
+                '/lifecycle/installed',
+                body=json.dumps(payload),
+                headers={'Content-Type': 'application/json'})
+        self.assertEqual(204, response.status_code)
+        self.assertEqual(
+            '/plugins/servlet/oauth/consumer-info', _StubAtlassian.requests[0][0])
+
+    def test_reinstall_uses_cached_consumer_info(self):
+        app = Chalice("app")
+        ac = AtlassianConnect(app, config=CONFIG, http=HttpClient(retries=0))
+        ac.lifecycle('installed')(lambda client: None)
+        payload = dict(
+            baseUrl=self.base_url,
+            clientKey='abc123',
+            publicKey='public123',
+            sharedSecret='myscret')
+        with Client(app) as client:
+            for _ in range(2):
+                response = client.http.post(
+                    '/lifecycle/installed',
+                    body=json.dumps(payload),
+                    headers={'Content-Type': 'application/json'})
+                ac.client_class.delete('abc123')
+                self.assertEqual(204, response.status_code)
+        self.assertEqual(1, len(_StubAtlassian.requests))
+
+
+class ConsumerInfoCacheTestCase(_StubServerTestCase):
+    """Test Case"""
+    def test_parses_consumer_info(self):
+        consumer_info = ConsumerInfoCache(HttpClient())
+        self.assertEqual(
+            ('abc123', 'public123'), consumer_info.get(self.base_url + '/'))
+        self.assertEqual(
+            ('abc123', 'public123'), consumer_info.get(self.base_url))
+        self.assertEqual(1, len(_StubAtlassian.requests))
+
+    def test_honours_cache_control(self):
+        consumer_info = ConsumerInfoCache(HttpClient())
+        _StubAtlassian.cache_control = 'no-store'
+        consumer_info.get(self.base_url)
+        _StubAtlassian.cache_control = 'public, max-age=0'
+        consumer_info.get(self.base_url)
+        consumer_info.get(self.base_url)
+        self.assertEqual(3, len(_StubAtlassian.requests))
+
+        _StubAtlassian.cache_control = 'max-age=60'
+        consumer_info.get(self.base_url)
+        consumer_info.get(self.base_url)
+        self.assertEqual(4, len(_StubAtlassian.requests))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+from chalice import Chalice, ChaliceViewError
+from .. import AtlassianConnect
+from .test_auth import CONFIG
+
+
+class UrlForTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice("app")
+        self.ac = AtlassianConnect(self.app, config=CONFIG)
+
+        @self.app.route('/issues/{issue_key}', methods=['GET'])
+        def show_issue(issue_key):
+            pass
+
+        @self.app.route('/issues', methods=['POST'])
+        def create_issue():
+            pass
+
+    def test_lookup(self):
+        self.assertEqual('/atlassian-connect.json', self.ac.url_for('_get_descriptor'))
+        self.assertEqual('/issues', self.ac.url_for('create_issue', _method='POST'))
+        self.assertRaises(
+            ChaliceViewError, self.ac.url_for, 'create_issue', _method='GET')
+        self.assertRaises(ChaliceViewError, self.ac.url_for, 'nope')
+
+    def test_path_params(self):
+        self.assertEqual(
+            '/issues/TEST-1', self.ac.url_for('show_issue', issue_key='TEST-1'))
+        self.assertEqual(
+            '/issues/a%2Fb?expand=all',
+            self.ac.url_for('show_issue', issue_key='a/b', expand='all'))
+        self.assertRaises(ChaliceViewError, self.ac.url_for, 'show_issue')
+
+    def test_index_rebuilt_for_new_routes(self):
+        self.ac.url_for('create_issue')
+        index = self.ac._url_index
+
+        @self.app.route('/later')
+        def later():
+            pass
+
+        self.assertEqual('/later', self.ac.url_for('later'))
+        self.assertIsNot(index, self.ac._url_index)
+
+        # Adding a method to an existing path is picked up too
+        self.app.route('/issues', methods=['PUT'])(lambda: None)
+        self.assertEqual('/issues', self.ac.url_for('<lambda>', _method='PUT'))
+
+
+if __name__ == '__main__':
+    unittest.main()
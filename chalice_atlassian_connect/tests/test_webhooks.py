@@ -0,0 +1,245 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from botocore.stub import Stubber
+import boto3
+from chalice import Chalice
+from chalice.test import Client
+from .. import AtlassianConnect, ClientRecord
+from ..webhooks import (
+    DynamoDBDeliveryStore,
+    MemoryWebhookQueue,
+    SQLiteWebhookQueue,
+    SQSWebhookQueue,
+    WebhookDeduplicator,
+)
+from .test_auth import CONFIG
+from .test_cache import _Clock
+from atlassian_jwt.encode import encode_token
+
+QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/123456789012/webhooks'
+
+
+class _QueueTests(object):
+    """Behaviour every local queue shares"""
+    def test_receive_hides_until_timeout(self):
+        for i in range(3):
+            self.queue.put('body%d' % i)
+        received = self.queue.receive(2)
+        self.assertEqual(['body0', 'body1'], [body for _, body in received])
+        self.assertEqual(['body2'], [body for _, body in self.queue.receive(10)])
+        self.assertEqual([], self.queue.receive(10))
+
+        self.queue.delete([received[0][0]])
+        self.clock.now += 31
+        self.assertEqual(['body1', 'body2'], [body for _, body in self.queue.receive(10)])
+        self.assertEqual(2, len(self.queue))
+
+
+class MemoryWebhookQueueTestCase(_QueueTests, unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.clock = _Clock()
+        self.queue = MemoryWebhookQueue(visibility_timeout=30, timer=self.clock)
+
+
+class SQLiteWebhookQueueTestCase(_QueueTests, unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.clock = _Clock()
+        self.queue = SQLiteWebhookQueue(
+            os.path.join(self.directory, 'queue.db'), visibility_timeout=30, timer=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_instances(self):
+        self.queue.put('body')
+        other = SQLiteWebhookQueue(self.queue.path, timer=self.clock)
+        self.assertEqual(['body'], [body for _, body in other.receive(10)])
+        self.assertEqual([], self.queue.receive(10))
+
+
+class SQSWebhookQueueTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_round_trip(self):
+        client = boto3.session.Session(
+            region_name='us-east-1',
+            aws_access_key_id='testing',
+            aws_secret_access_key='testing').client('sqs')
+        stubber = Stubber(client)
+        stubber.add_response(
+            'send_message', {'MessageId': '1'},
+            {'QueueUrl': QUEUE_URL, 'MessageBody': 'body'})
+        stubber.add_response(
+            'receive_message',
+            {'Messages': [{'ReceiptHandle': 'r%d' % i, 'Body': 'body'} for i in range(10)]},
+            {'QueueUrl': QUEUE_URL, 'MaxNumberOfMessages': 10, 'WaitTimeSeconds': 0})
+        stubber.add_response(
+            'delete_message_batch', {'Successful': [], 'Failed': []},
+            {'QueueUrl': QUEUE_URL, 'Entries': [
+                {'Id': str(i), 'ReceiptHandle': 'r%d' % i} for i in range(10)]})
+        stubber.add_response(
+            'delete_message_batch', {'Successful': [], 'Failed': []},
+            {'QueueUrl': QUEUE_URL, 'Entries': [{'Id': '0', 'ReceiptHandle': 'r10'}]})
+        queue = SQSWebhookQueue(QUEUE_URL, client=client)
+        with stubber:
+            queue.put('body')
+            received = queue.receive(25)
+            queue.delete([receipt for receipt, _ in received] + ['r10'])
+        stubber.assert_no_pending_responses()
+
+
+class AsyncWebhookTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.app = Chalice('app')
+        self.queue = MemoryWebhookQueue()
+        self.ac = AtlassianConnect(self.app, config=CONFIG, webhook_queue=self.queue)
+        self.ac.client_class.save(ClientRecord(clientKey='abc', sharedSecret='myscret'))
+        self.events = []
+
+        @self.ac.webhook('jira:issue_created')
+        def issue_created(client, event):
+            if event.get('fail'):
+                raise ValueError('handler failed')
+            self.events.append((client.clientKey, event))
+
+    def _post(self, body, secret='myscret'):
+        auth = encode_token('POST', '/webhooks/jiraissue_created', 'abc', secret)
+        with Client(self.app) as client:
+            return client.http.post(
+                '/webhooks/jiraissue_created',
+                body=json.dumps(body),
+                headers={'Content-Type': 'application/json',
+                         'Authorization': 'JWT ' + auth})
+
+    def test_acknowledged_before_handling(self):
+        self.assertEqual(204, self._post({'issue': 'TEST-1'}).status_code)
+        self.assertEqual(204, self._post({'issue': 'TEST-2'}).status_code)
+        self.assertEqual([], self.events)
+        self.assertEqual(2, len(self.queue))
+
+        self.assertEqual(2, self.ac.process_webhooks(batch_size=1))
+        self.assertEqual(
+            [('abc', {'issue': 'TEST-1'}), ('abc', {'issue': 'TEST-2'})], self.events)
+        self.assertEqual(0, len(self.queue))
+
+    def test_unauthenticated_not_queued(self):
+        self.assertEqual(401, self._post({'issue': 'TEST-1'}, secret='wrong').status_code)
+        self.assertEqual(0, len(self.queue))
+
+    def test_failures_stay_queued(self):
+        self._post({'fail': True})
+        self._post({'issue': 'TEST-1'})
+        self.assertEqual(1, self.ac.process_webhooks(max_batches=1))
+        self.assertEqual([('abc', {'issue': 'TEST-1'})], self.events)
+        self.assertEqual(1, len(self.queue))
+
+
+class _SharedStore(object):
+    """Delivery store shared by several add-on instances"""
+    def __init__(self):
+        self.keys = set()
+
+    def claim(self, key, ttl):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def release(self, key):
+        self.keys.discard(key)
+
+
+class DeduplicationTestCase(unittest.TestCase):
+    """Test Case"""
+    def setUp(self):
+        self.events = []
+        self.store = _SharedStore()
+        self.app, self.ac = self._addon()
+
+    def _addon(self, **kwargs):
+        app = Chalice('app')
+        ac = AtlassianConnect(
+            app, config=CONFIG, webhook_dedup=WebhookDeduplicator(store=self.store), **kwargs)
+        ac.client_class.save(ClientRecord(clientKey='abc', sharedSecret='myscret'))
+
+        @ac.webhook('jira:issue_created')
+        def issue_created(client, event):
+            if event.get('fail'):
+                raise ValueError('handler failed')
+            self.events.append(event)
+        return app, ac
+
+    def _post(self, body, delivery_id=None, app=None):
+        auth = encode_token('POST', '/webhooks/jiraissue_created', 'abc', 'myscret')
+        headers = {'Content-Type': 'application/json', 'Authorization': 'JWT ' + auth}
+        if delivery_id:
+            headers['X-Atlassian-Webhook-Identifier'] = delivery_id
+        with Client(app or self.app) as client:
+            return client.http.post(
+                '/webhooks/jiraissue_created', body=json.dumps(body), headers=headers)
+
+    def test_delivery_identifier(self):
+        for body in ({'issue': 'TEST-1'}, {'issue': 'TEST-1', 'retry': 1}):
+            self.assertEqual(204, self._post(body, delivery_id='delivery-1').status_code)
+        self._post({'issue': 'TEST-1'}, delivery_id='delivery-2')
+        self.assertEqual([{'issue': 'TEST-1'}, {'issue': 'TEST-1'}], self.events)
+        self.assertEqual(1, self.ac.webhook_dedup.stats()['suppressed'])
+
+    def test_payload_hash(self):
+        self._post({'issue': 'TEST-1'})
+        self._post({'issue': 'TEST-1'})
+        self._post({'issue': 'TEST-2'})
+        self.assertEqual([{'issue': 'TEST-1'}, {'issue': 'TEST-2'}], self.events)
+
+    def test_failed_delivery_retried(self):
+        self.assertEqual(500, self._post({'fail': True}, delivery_id='d').status_code)
+        self.assertEqual(0, self.ac.webhook_dedup.stats()['suppressed'])
+        self.assertEqual(set(), self.store.keys)
+
+    def test_shared_store(self):
+        other_app, other = self._addon()
+        self._post({'issue': 'TEST-1'}, delivery_id='d')
+        self._post({'issue': 'TEST-1'}, delivery_id='d', app=other_app)
+        self.assertEqual([{'issue': 'TEST-1'}], self.events)
+        self.assertEqual(1, other.webhook_dedup.stats()['suppressed'])
+
+    def test_queued(self):
+        queue = MemoryWebhookQueue()
+        app, _ = self._addon(webhook_queue=queue)
+        self._post({'issue': 'TEST-1'}, delivery_id='d', app=app)
+        self._post({'issue': 'TEST-1'}, delivery_id='d', app=app)
+        self.assertEqual(1, len(queue))
+
+
+class DynamoDBDeliveryStoreTestCase(unittest.TestCase):
+    """Test Case"""
+    def test_conditional_claim(self):
+        table = boto3.session.Session(
+            region_name='us-east-1',
+            aws_access_key_id='testing',
+            aws_secret_access_key='testing').resource('dynamodb').Table('deliveries')
+        stubber = Stubber(table.meta.client)
+        expected = {
+            'TableName': 'deliveries',
+            'Item': {'deliveryId': 'abc:d', 'expiresAt': 1060},
+            'ConditionExpression': 'attribute_not_exists(deliveryId) OR expiresAt < :now',
+            'ExpressionAttributeValues': {':now': 1000}}
+        stubber.add_response('put_item', {}, expected)
+        stubber.add_client_error(
+            'put_item', service_error_code='ConditionalCheckFailedException',
+            expected_params=expected)
+        store = DynamoDBDeliveryStore(table=table, timer=_Clock())
+        with stubber:
+            self.assertTrue(store.claim('abc:d', 60))
+            self.assertFalse(store.claim('abc:d', 60))
+        stubber.assert_no_pending_responses()
+
+
+if __name__ == '__main__':
+    unittest.main()
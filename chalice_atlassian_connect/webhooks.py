@@ -0,0 +1,278 @@
+"""Queues webhook deliveries are put on when they are processed asynchronously
+
+A queue has three methods, deliveries being JSON strings:
+
+* put(body): add a delivery
+* receive(max_messages): list of up to max_messages (receipt, body) pairs.
+  Received deliveries are hidden from other receivers until deleted or
+  until their visibility timeout runs out, so failures are retried.
+* delete(receipts): forget handled deliveries
+
+A :py:class:`WebhookDeduplicator` drops deliveries Atlassian sends more
+than once.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from .cache import ClientCache
+from .client import _dynamodb_resource
+
+# SQS refuses to receive or delete more messages than this in one call
+_SQS_BATCH_SIZE = 10
+
+
+class MemoryWebhookQueue(object):
+    """
+    Webhook queue kept in memory, for tests and local development
+
+    :param visibility_timeout: seconds a received delivery stays hidden
+    """
+    def __init__(self, visibility_timeout=30, timer=time.time):
+        self.visibility_timeout = visibility_timeout
+        self._timer = timer
+        self._messages = OrderedDict()
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._messages)
+
+    def put(self, body):
+        with self._lock:
+            self._messages[next(self._ids)] = [body, 0]
+
+    def receive(self, max_messages=10):
+        now = self._timer()
+        received = []
+        with self._lock:
+            for receipt, message in self._messages.items():
+                if len(received) >= max_messages:
+                    break
+                if message[1] <= now:
+                    message[1] = now + self.visibility_timeout
+                    received.append((receipt, message[0]))
+        return received
+
+    def delete(self, receipts):
+        with self._lock:
+            for receipt in receipts:
+                self._messages.pop(receipt, None)
+
+
+class SQLiteWebhookQueue(object):
+    """
+    Webhook queue in a SQLite database, which several local processes can
+    share
+
+    :param path: database file
+    :param visibility_timeout: seconds a received delivery stays hidden
+    """
+    def __init__(self, path, visibility_timeout=30, timer=time.time):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self._timer = timer
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS webhook_queue ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'body TEXT NOT NULL, '
+            'visible_at REAL NOT NULL DEFAULT 0)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            import sqlite3
+            # Transactions are started explicitly, see receive
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM webhook_queue').fetchone()[0]
+
+    def put(self, body):
+        self._connection().execute(
+            'INSERT INTO webhook_queue (body) VALUES (?)', (body,))
+
+    def receive(self, max_messages=10):
+        connection = self._connection()
+        now = self._timer()
+        # Taking the write lock up front stops two workers claiming a row
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            received = connection.execute(
+                'SELECT id, body FROM webhook_queue WHERE visible_at <= ? '
+                'ORDER BY id LIMIT ?', (now, max_messages)).fetchall()
+            connection.executemany(
+                'UPDATE webhook_queue SET visible_at = ? WHERE id = ?',
+                [(now + self.visibility_timeout, receipt) for receipt, _ in received])
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return received
+
+    def delete(self, receipts):
+        self._connection().executemany(
+            'DELETE FROM webhook_queue WHERE id = ?', [(r,) for r in receipts])
+
+
+class SQSWebhookQueue(object):
+    """
+    Webhook queue backed by SQS, or anything speaking its API
+
+    The queue's own visibility timeout applies to received deliveries.
+
+    :param queue_url: URL of the queue
+    :param client: boto3 SQS client, one is built on first use if not given
+    :param wait_time: seconds receive long polls for, at most 20
+    """
+    def __init__(self, queue_url, client=None, wait_time=0):
+        self.queue_url = queue_url
+        self.wait_time = wait_time
+        self._client = client
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise ImportError(
+                    'SQSWebhookQueue needs boto3, install Chalice-AtlassianConnect[sqs]')
+            self._client = boto3.client('sqs')
+        return self._client
+
+    def put(self, body):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=body)
+
+    def receive(self, max_messages=10):
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=min(max_messages, _SQS_BATCH_SIZE),
+            WaitTimeSeconds=self.wait_time)
+        return [(m['ReceiptHandle'], m['Body']) for m in response.get('Messages', [])]
+
+    def delete(self, receipts):
+        receipts = list(receipts)
+        for start in range(0, len(receipts), _SQS_BATCH_SIZE):
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(i), 'ReceiptHandle': receipt} for i, receipt
+                         in enumerate(receipts[start:start + _SQS_BATCH_SIZE])])
+
+
+class WebhookDeduplicator(object):
+    """
+    Remembers webhook deliveries so retried and duplicated ones are
+    acknowledged without running their handler again.
+
+    Deliveries are identified by their X-Atlassian-Webhook-Identifier
+    header, or by a hash of the event and body when there is none. Ids
+    are kept in a bounded in-process LRU and, if a `store` is given, in a
+    store shared between instances such as :py:class:`DynamoDBDeliveryStore`.
+
+    :param maxsize: delivery ids kept in process
+    :param ttl: seconds a delivery id is remembered
+    :param store: shared store with claim(key, ttl) and release(key)
+    """
+    def __init__(self, maxsize=10000, ttl=3600, store=None, timer=time.time):
+        self.ttl = ttl
+        self.store = store
+        self._seen = ClientCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def _suppress(self):
+        with self._lock:
+            self.suppressed += 1
+
+    def seen(self, key):
+        """
+        Check the in-process ids only, a duplicate found is counted
+
+        :rtype: bool"""
+        if self._seen.get(key, None) is None:
+            return False
+        self._suppress()
+        return True
+
+    def claim(self, key):
+        """
+        Record a delivery, unless it was already, in which case it is
+        counted as a duplicate
+
+        :returns: whether the delivery is new
+        :rtype: bool"""
+        with self._lock:
+            if self._seen.get(key, None) is not None:
+                self.suppressed += 1
+                return False
+            self._seen.set(key, True)
+        if self.store is not None:
+            try:
+                claimed = self.store.claim(key, self.ttl)
+            except Exception:
+                self._seen.invalidate(key)
+                raise
+            if not claimed:
+                self._suppress()
+                return False
+        return True
+
+    def release(self, key):
+        """Forget a delivery whose handling failed, so a retry is handled"""
+        self._seen.invalidate(key)
+        if self.store is not None:
+            self.store.release(key)
+
+    def stats(self):
+        """
+        Counters suitable for shipping to a metrics system
+
+        :rtype: dict"""
+        return {'suppressed': self.suppressed, 'size': len(self._seen)}
+
+
+class DynamoDBDeliveryStore(object):
+    """
+    Delivery ids shared between instances, claimed with a conditional
+    write. The table is keyed on a deliveryId string, enable DynamoDB's
+    TTL on its expiresAt attribute to have old ids cleaned up.
+
+    :param table: boto3 Table resource to use instead
+    :param table_name: name of the deliveries table
+    :param resource_options: settings of the shared DynamoDB resource, see
+        :py:class:`~chalice_atlassian_connect.client.DynamoDBAtlassianConnectClient`
+    """
+    def __init__(self, table=None, table_name='AtlassianConnectWebhookDeliveries',
+                 timer=time.time, **resource_options):
+        self._table = table
+        self._table_name = table_name
+        self._timer = timer
+        self._resource_options = resource_options
+
+    @property
+    def table(self):
+        if self._table is None:
+            self._table = _dynamodb_resource(
+                **self._resource_options).Table(self._table_name)
+        return self._table
+
+    def claim(self, key, ttl):
+        now = int(self._timer())
+        try:
+            self.table.put_item(
+                Item={'deliveryId': key, 'expiresAt': now + ttl},
+                # TTL deletion lags, expired ids can be claimed again
+                ConditionExpression='attribute_not_exists(deliveryId) OR expiresAt < :now',
+                ExpressionAttributeValues={':now': now})
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def release(self, key):
+        self.table.delete_item(Key={'deliveryId': key})
@@ -30,6 +30,7 @@ setup(
     include_package_data=True,
     platforms='any',
     install_requires=io.open('requirements/runtime.txt').readlines(),
+    extras_require={'dynamodb': ['boto3'], 'sqs': ['boto3'], 'encryption': ['cryptography']},
     setup_requires=['pytest-runner'],
     keywords=['atlassian connect', 'chalice', 'jira', 'confluence'],
     tests_require=[x for x in io.open(